@@ -1,13 +1,34 @@
-from flask import Flask, request, redirect, url_for, send_file, flash, get_flashed_messages, render_template_string
+from flask import Flask, request, redirect, url_for, send_file, flash, get_flashed_messages, render_template, jsonify, Response, session, g
+from flask import before_render_template, template_rendered, has_app_context, has_request_context
+from markupsafe import Markup
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 import os
-import pandas as pd
 import io
-from openpyxl.utils import get_column_letter
+import csv
+import tempfile
+from urllib.parse import quote
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import create_engine, text
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy import create_engine, text, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 import sqlite3
+import sys
+import threading
+import time
+import json
+import base64
+import hashlib
+import hmac
+import bisect
+import re
+import secrets
+import socket
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from datetime import datetime, timezone, date as date_type
+from decimal import Decimal
 
 app = Flask(__name__)
 app.secret_key = 'your-super-secret-key-change-this-in-production'
@@ -24,8 +45,427 @@ class User(UserMixin):
         self.username = username
         self.password_hash = password_hash
 
+# Metrics ต่อ process ในรูปแบบ Prometheus text: เวลาตอบต่อ endpoint, เวลา/จำนวนแถวของ SQL, เวลา render template และไฟล์ export
+# เก็บเป็นตัวนับใน memory (lock สั้น ๆ ต่อการบันทึกหนึ่งครั้ง) แต่ละ gunicorn worker มีชุดของตัวเอง
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _metric_labels(names, values):
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, *labels):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.lock:
+            series = sorted(self.series.items())
+        lines += [f'{self.name}{_metric_labels(self.label_names, labels)} {value}' for labels, value in series]
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                # จำนวนต่อช่อง (ช่องสุดท้ายคือ +Inf) ตามด้วยผลรวม
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            snapshot = sorted((labels, list(series)) for labels, series in self.series.items())
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_metric_labels(self.label_names + ("le",), labels + (le,))} {cumulative}')
+            lines.append(f'{self.name}_sum{_metric_labels(self.label_names, labels)} {series[-1]}')
+            lines.append(f'{self.name}_count{_metric_labels(self.label_names, labels)} {cumulative}')
+        return lines
+
+REQUESTS_TOTAL = Counter('http_requests_total', 'HTTP responses by endpoint, method and status.', ('endpoint', 'method', 'status'))
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time to produce the full response body.', ('endpoint', 'method'))
+QUERY_SECONDS = Histogram('db_query_duration_seconds', 'SQL execute time by statement type.', ('backend', 'statement'))
+QUERY_ROWS = Counter('db_query_rows_total', 'Rows reported by cursor.rowcount (SELECT on PostgreSQL, DML on both).', ('backend', 'statement'))
+TEMPLATE_SECONDS = Histogram('template_render_duration_seconds', 'Jinja render time by template.', ('template',))
+EXPORT_SECONDS = Histogram('export_render_duration_seconds', 'Time spent building an export file, including reading rows.', ('format',))
+METRICS = (REQUESTS_TOTAL, REQUEST_SECONDS, QUERY_SECONDS, QUERY_ROWS, TEMPLATE_SECONDS, EXPORT_SECONDS)
+SQL_STATEMENTS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'CREATE', 'ALTER', 'PRAGMA', 'BEGIN', 'COPY'}
+
+def record_query(backend, statement, seconds, rowcount):
+    keyword = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+    keyword = keyword if keyword in SQL_STATEMENTS else 'OTHER'
+    QUERY_SECONDS.observe(seconds, backend, keyword)
+    if rowcount is not None and rowcount >= 0:
+        QUERY_ROWS.inc(rowcount, backend, keyword)
+
+def timed_iter(iterable, histogram, *labels):
+    # จับเวลาเฉพาะตอนสร้างแต่ละ chunk ไม่รวมเวลาที่รอส่งให้ client
+    elapsed = 0.0
+    iterator = iter(iterable)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        histogram.observe(elapsed, *labels)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    labels = (request.endpoint or 'unmatched', request.method)
+    status = str(response.status_code)
+
+    def observe():
+        REQUEST_SECONDS.observe(time.perf_counter() - started, *labels)
+        REQUESTS_TOTAL.inc(1, *labels, status)
+
+    # response แบบ stream (CSV) นับเวลาจนส่งครบ; send_file (direct_passthrough) สร้างไฟล์เสร็จแล้ว และ
+    # werkzeug ไม่เรียก call_on_close ให้ จึงบันทึกทันที
+    if response.is_streamed and not response.direct_passthrough:
+        response.call_on_close(observe)
+    else:
+        observe()
+    return response
+
+@before_render_template.connect_via(app)
+def _start_template_timer(sender, template, context, **extra):
+    g.setdefault('template_started', []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def _record_template_time(sender, template, context, **extra):
+    started = g.get('template_started')
+    if started:
+        TEMPLATE_SECONDS.observe(time.perf_counter() - started.pop(), template.name or 'string')
+
+# Database Setup
+# PostgreSQL: สร้าง engine + connection pool แค่ครั้งเดียวต่อ worker process แล้วใช้ซ้ำทุก request
+# ปรับขนาด pool ได้ผ่าน environment variables
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+POOL_SIZE = _env_int('DB_POOL_SIZE', 5)
+POOL_MAX_OVERFLOW = _env_int('DB_MAX_OVERFLOW', 10)
+POOL_TIMEOUT = _env_int('DB_POOL_TIMEOUT', 30)
+POOL_RECYCLE = _env_int('DB_POOL_RECYCLE', 1800)
+POOL_PRE_PING = _env_bool('DB_POOL_PRE_PING', True)
+
+# สถิติเวลารอ connection จาก pool (สะสมตลอดอายุ process)
+pool_wait_stats = {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'timeouts': 0}
+_pool_stats_lock = threading.Lock()
+
+class TimedQueuePool(QueuePool):
+    # QueuePool ที่จับเวลารอ connection ทุกครั้งที่ checkout
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            with _pool_stats_lock:
+                pool_wait_stats['timeouts'] += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with _pool_stats_lock:
+                pool_wait_stats['count'] += 1
+                pool_wait_stats['total_seconds'] += waited
+                if waited > pool_wait_stats['max_seconds']:
+                    pool_wait_stats['max_seconds'] = waited
+
+_engine = None
+_Session = None
+_read_engine = None
+_ReadSession = None
+_engine_lock = threading.Lock()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record_query('postgresql', statement, time.perf_counter() - conn.info['query_started'].pop(), cursor.rowcount)
+
+def _create_engine(url):
+    engine = create_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=POOL_RECYCLE,
+        pool_pre_ping=POOL_PRE_PING,
+    )
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    return engine
+
+def get_engine():
+    global _engine, _Session
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = _create_engine(os.environ['DATABASE_URL'])
+                _Session = sessionmaker(bind=engine)
+                _engine = engine
+                print(f"Connected to PostgreSQL (pool_size={POOL_SIZE}, max_overflow={POOL_MAX_OVERFLOW})")
+    return _engine
+
+def get_read_engine():
+    global _read_engine, _ReadSession
+    if _read_engine is None:
+        with _engine_lock:
+            if _read_engine is None:
+                engine = _create_engine(DATABASE_READ_URL)
+                _ReadSession = sessionmaker(bind=engine)
+                _read_engine = engine
+                print(f"Connected to PostgreSQL read replica (pool_size={POOL_SIZE}, max_overflow={POOL_MAX_OVERFLOW})")
+    return _read_engine
+
+def _dispose_engine_after_fork():
+    # ห้ามใช้ connection ที่สืบทอดมาจาก process แม่ (เช่น gunicorn --preload)
+    for engine in (_engine, _read_engine):
+        if engine is not None:
+            engine.dispose(close=False)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_engine_after_fork)
+
+def get_pool_stats():
+    if 'DATABASE_URL' not in os.environ:
+        return {'backend': 'sqlite'}
+    pool = get_engine().pool
+    with _pool_stats_lock:
+        waits = dict(pool_wait_stats)
+    return {
+        'backend': 'postgresql',
+        'pool_size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+        'max_overflow': POOL_MAX_OVERFLOW,
+        'wait_count': waits['count'],
+        'wait_seconds_total': round(waits['total_seconds'], 6),
+        'wait_seconds_avg': round(waits['total_seconds'] / waits['count'], 6) if waits['count'] else 0.0,
+        'wait_seconds_max': round(waits['max_seconds'], 6),
+        'wait_timeouts': waits['timeouts'],
+    }
+
+# SQLite: ใช้ WAL ให้ผู้อ่าน (/list, /export) ไม่บล็อกผู้เขียน (บันทึก/ลบ) และกลับกัน
+# connection เดียวต่อ thread ใช้ซ้ำข้าม request (PRAGMA และ page cache ไม่ต้องเริ่มใหม่ทุกครั้ง)
+# ตอน teardown แค่ rollback transaction ที่ค้าง
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'database.db')
+SQLITE_BUSY_TIMEOUT_MS = _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+SQLITE_CACHE_KB = _env_int('SQLITE_CACHE_KB', 16384)
+
+_sqlite_local = threading.local()
+_inherited_sqlite = []
+
+def _reset_sqlite_after_fork():
+    # connection ของ process แม่ห้ามใช้และห้ามปิดใน process ลูก (การปิดอาจ checkpoint/ลบไฟล์ WAL ที่แม่ยังใช้อยู่)
+    global _sqlite_local
+    _inherited_sqlite.append(_sqlite_local)
+    _sqlite_local = threading.local()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_sqlite_after_fork)
+
+# sqlite3 ไม่มี event ให้ดัก จึงจับเวลา SQL ผ่าน cursor/connection subclass
+class TimedSQLiteCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query('sqlite', sql, time.perf_counter() - start, self.rowcount)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_query('sqlite', sql, time.perf_counter() - start, self.rowcount)
+
+class TimedSQLiteConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedSQLiteCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def connect_sqlite(replica=False):
+    if replica:
+        # ไฟล์สำเนาต้องมีอยู่แล้ว (mode=rw ไม่สร้างไฟล์เปล่า) และห้ามเขียนผ่าน connection นี้
+        uri = f"file:{quote(os.path.abspath(SQLITE_READ_PATH))}?mode=rw"
+        conn = sqlite3.connect(uri, uri=True, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, factory=TimedSQLiteConnection)
+        conn.execute("PRAGMA query_only=ON")
+    else:
+        conn = sqlite3.connect(SQLITE_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, factory=TimedSQLiteConnection)
+        # journal_mode=WAL ถูกบันทึกไว้ในไฟล์ฐานข้อมูล สั่งซ้ำได้ไม่มีผล
+        conn.execute("PRAGMA journal_mode=WAL")
+        if SQLITE_SYNCHRONOUS in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+            conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+    return conn
+
+# Read replica (ไม่บังคับ): route ที่อ่านอย่างเดียว (/list, /list/data, /export, prefill ของฟอร์มแก้ไข) เรียก
+# use_read_replica() แล้ว query ที่เหลือของ request นั้นไปที่ DATABASE_READ_URL (PostgreSQL) หรือ SQLITE_READ_PATH
+# (SQLite เช่นไฟล์ที่ Litestream/sqlite3 .backup ทำสำเนาไว้) แทน primary การ scan ตารางจึงไม่แย่ง I/O กับการบันทึก
+# replica ตามหลัง primary ได้: หลังผู้ใช้บันทึก/ลบ จำ data_version ที่เขียนไว้ใน session แล้วอ่าน replica เฉพาะเมื่อ
+# data_version ของ replica ตามทันแล้ว (read-your-writes) ถ้าต่อ replica ไม่ได้ใช้ primary ไปก่อน READ_REPLICA_RETRY วินาที
+# (PostgreSQL: ใส่ ?connect_timeout=... ใน URL ไม่ให้รอนานตอน replica ล่ม)
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL')
+SQLITE_READ_PATH = os.environ.get('SQLITE_READ_PATH')
+READ_REPLICA_RETRY = _env_int('READ_REPLICA_RETRY', 30)
+
+def read_replica_configured():
+    return bool(DATABASE_READ_URL if 'DATABASE_URL' in os.environ else SQLITE_READ_PATH)
+
+def reading_replica():
+    return has_app_context() and g.get('read_replica', False)
+
+def get_db(replica=None):
+    if replica is None:
+        replica = reading_replica()
+    if 'DATABASE_URL' in os.environ:
+        try:
+            if replica:
+                get_read_engine()
+                return _ReadSession
+            get_engine()
+            return _Session
+        except Exception as e:
+            print(f"PostgreSQL error: {e}")
+            return None
+    else:
+        attr = 'read_conn' if replica else 'conn'
+        try:
+            conn = getattr(_sqlite_local, attr, None)
+            if conn is None:
+                conn = connect_sqlite(replica)
+                setattr(_sqlite_local, attr, conn)
+            return conn
+        except Exception as e:
+            print(f"SQLite error: {e}")
+            return None
+
+@app.teardown_appcontext
+def close_db(exception=None):
+    # connection ของ SQLite อยู่ต่อกับ thread แค่ rollback transaction ที่ค้างจาก error ไม่ให้ถือ lock ข้าม request
+    conn = getattr(_sqlite_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+    # ไฟล์ replica อาจถูกแทนที่ทั้งไฟล์ (เช่น restore สำเนาใหม่แล้ว rename) จึงเปิดใหม่ทุก request
+    conn = getattr(_sqlite_local, 'read_conn', None)
+    if conn is not None:
+        _sqlite_local.read_conn = None
+        conn.close()
+
+# cache ของ User ต่อ process (LRU + TTL) เพื่อไม่ให้ทุก request ที่ login แล้วต้อง query ตาราง users
+# TTL จำกัดเวลาที่ worker อื่นจะเห็นข้อมูลผู้ใช้เก่า หลังแก้/ลบผู้ใช้ให้เรียก user_cache.invalidate(id)
+class UserCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        key = str(user_id)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, user):
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        key = str(user.id)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, user)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'max_size': self.max_size, 'ttl_seconds': self.ttl,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+user_cache = UserCache(_env_int('USER_CACHE_SIZE', 1024), _env_int('USER_CACHE_TTL', 300))
+
 @login_manager.user_loader
 def load_user(user_id):
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
     db = get_db()
     try:
         if 'DATABASE_URL' in os.environ:
@@ -33,38 +473,438 @@ def load_user(user_id):
             with db() as session:
                 result = session.execute(text("SELECT id, username, password_hash FROM users WHERE id = :id"), {'id': user_id})
                 row = result.fetchone()
-                return User(row[0], row[1], row[2]) if row else None
         else:
             # SQLite
             cursor = db.cursor()
             cursor.execute("SELECT id, username, password_hash FROM users WHERE id = ?", (user_id,))
             row = cursor.fetchone()
-            db.close()
-            return User(row[0], row[1], row[2]) if row else None
     except:
         return None
+    if row is None:
+        return None
+    user = User(row[0], row[1], row[2])
+    user_cache.put(user)
+    return user
 
-# Database Setup
-def get_db():
+def fetch_all(sql, params=None):
+    # SELECT ที่ใช้ได้ทั้ง PostgreSQL และ SQLite (ใช้ :name placeholder เหมือนกันทั้งสองฝั่ง)
+    db = get_db()
     if 'DATABASE_URL' in os.environ:
+        with db() as session:
+            return [tuple(row) for row in session.execute(text(sql), params or {}).fetchall()]
+    return db.execute(sql, params or {}).fetchall()
+
+# เลขลำดับของรหัสตัวอย่าง: BASE-1, BASE-2, ...
+# เก็บเลขล่าสุดของแต่ละ BASE ไว้ใน code_counters แล้วเพิ่มค่าแบบ atomic ใน transaction เดียวกับ INSERT
+# (SQLite >= 3.35 และ PostgreSQL รองรับ ON CONFLICT ... RETURNING เหมือนกัน)
+# :n คือจำนวนเลขที่จองในครั้งเดียว (ได้เลขล่าสุดกลับมา เลขที่จองคือ last_num - n + 1 ถึง last_num)
+NEXT_SUFFIX_SQL = """
+    INSERT INTO code_counters (base_code, last_num) VALUES (:base, :n)
+    ON CONFLICT (base_code) DO UPDATE SET last_num = code_counters.last_num + :n
+    RETURNING last_num
+"""
+
+def split_code(code):
+    base, sep, suffix = code.rpartition('-')
+    if sep and base and suffix.isdigit():
+        return base, int(suffix)
+    return None, None
+
+def build_code_counters(codes):
+    # ใช้ครั้งเดียวตอนสร้าง code_counters: หาเลขลำดับสูงสุดของแต่ละ BASE จากข้อมูลเดิม
+    counters = {}
+    for code in codes:
+        base, num = split_code(code)
+        if base is not None and num > counters.get(base, 0):
+            counters[base] = num
+    return counters
+
+# วันที่: PostgreSQL เก็บเป็น DATE, SQLite เก็บเป็นข้อความ ISO (YYYY-MM-DD) ซึ่งเรียง/เทียบช่วงได้ถูกต้อง
+# ฟอร์มและไฟล์ export ยังแสดงเป็น dd/mm/YYYY เหมือนเดิม (ปี พ.ศ. > 2400 จะถูกแปลงเป็น ค.ศ.)
+DATE_PATTERNS = (
+    (re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{4})$'), ('day', 'month', 'year')),
+    (re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})$'), ('year', 'month', 'day')),
+)
+
+def parse_entry_date(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date_type):
+        return value
+    value = str(value).strip()
+    if not value:
+        return None
+    for pattern, fields in DATE_PATTERNS:
+        match = pattern.match(value)
+        if match:
+            parts = dict(zip(fields, map(int, match.groups())))
+            if parts['year'] > 2400:
+                parts['year'] -= 543
+            try:
+                return date_type(parts['year'], parts['month'], parts['day'])
+            except ValueError:
+                break
+    raise ValueError(f'วันที่ไม่ถูกต้อง: {value} (ต้องเป็น วว/ดด/ปปปป)')
+
+def db_date(value):
+    # ค่าที่ส่งเข้า database: ข้อความ ISO ใช้ได้ทั้งคอลัมน์ DATE ของ PostgreSQL และ SQLite
+    parsed = parse_entry_date(value)
+    return parsed.isoformat() if parsed else None
+
+def format_entry_date(value):
+    if value is None:
+        return None
+    if isinstance(value, str) and len(value) == 10 and value[4] == '-':
+        return f"{value[8:10]}/{value[5:7]}/{value[0:4]}"
+    return parse_entry_date(value).strftime('%d/%m/%Y')
+
+def _lenient_db_date(value):
+    try:
+        return db_date(value)
+    except ValueError:
+        return None
+
+LEGACY_DATES_TABLE_SQL = "CREATE TABLE IF NOT EXISTS entries_date_legacy (code VARCHAR(50) PRIMARY KEY, raw TEXT NOT NULL)"
+
+def report_legacy_dates(count):
+    if count:
+        print(f"WARNING: {count} entries have dates that could not be parsed; entries.date is set to NULL "
+              f"and the original text is kept in entries_date_legacy (code, raw) for manual repair")
+
+def migrate_entry_dates_postgres(session):
+    data_type = session.execute(text(
+        "SELECT data_type FROM information_schema.columns WHERE table_name = 'entries' AND column_name = 'date'"
+    )).scalar()
+    if data_type == 'date':
+        return
+    session.execute(text(r"""
+        CREATE OR REPLACE FUNCTION pg_temp.parse_entry_date(raw TEXT) RETURNS DATE AS $$
+        DECLARE
+            s TEXT := btrim(raw);
+            y INT; m INT; d INT;
+        BEGIN
+            IF s ~ '^\d{1,2}/\d{1,2}/\d{4}$' THEN
+                d := split_part(s, '/', 1)::INT; m := split_part(s, '/', 2)::INT; y := split_part(s, '/', 3)::INT;
+            ELSIF s ~ '^\d{4}-\d{1,2}-\d{1,2}$' THEN
+                y := split_part(s, '-', 1)::INT; m := split_part(s, '-', 2)::INT; d := split_part(s, '-', 3)::INT;
+            ELSE
+                RETURN NULL;
+            END IF;
+            IF y > 2400 THEN
+                y := y - 543;
+            END IF;
+            RETURN make_date(y, m, d);
+        EXCEPTION WHEN others THEN
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """))
+    # เก็บข้อความเดิมที่แปลงเป็นวันที่ไม่ได้ไว้ก่อน คอลัมน์ DATE จะเหลือเป็น NULL แต่ข้อมูลเดิมไม่หาย
+    session.execute(text(LEGACY_DATES_TABLE_SQL))
+    kept = session.execute(text(
+        "INSERT INTO entries_date_legacy (code, raw) SELECT code, date FROM entries "
+        "WHERE btrim(date) <> '' AND pg_temp.parse_entry_date(date) IS NULL ON CONFLICT (code) DO NOTHING"
+    )).rowcount
+    report_legacy_dates(kept)
+    session.execute(text("ALTER TABLE entries ALTER COLUMN date TYPE DATE USING pg_temp.parse_entry_date(date)"))
+    print("Migrated entries.date to DATE")
+
+def migrate_entry_dates_sqlite(db):
+    if db.execute("SELECT 1 FROM entries WHERE date LIKE '%/%' LIMIT 1").fetchone() is None:
+        return
+    db.create_function('parse_entry_date', 1, _lenient_db_date)
+    db.execute(LEGACY_DATES_TABLE_SQL)
+    kept = db.execute(
+        "INSERT OR IGNORE INTO entries_date_legacy (code, raw) SELECT code, date FROM entries "
+        "WHERE trim(date) <> '' AND parse_entry_date(date) IS NULL"
+    ).rowcount
+    report_legacy_dates(kept)
+    db.execute("UPDATE entries SET date = parse_entry_date(date) WHERE date IS NOT NULL")
+    print("Migrated entries.date to ISO dates")
+
+# เวอร์ชันของข้อมูล: ทุก transaction ที่เพิ่ม/ลบ entries จะ UPDATE แถวนี้ก่อน (ล็อกแถวเดียวกันทุกครั้ง)
+# ค่า version + updated_at ใช้เป็น ETag / Last-Modified ของ /list และ /export
+BUMP_VERSION_SQL = "UPDATE data_version SET version = version + 1, updated_at = :now WHERE id = 1"
+# อ่านใน transaction เดียวกับ BUMP_VERSION_SQL จะได้ version ที่ตัวเองเพิ่งสร้าง
+VERSION_SQL = "SELECT version FROM data_version WHERE id = 1"
+
+# เงื่อนไข "code อยู่ในรายการ" ใช้พารามิเตอร์ :codes ตัวเดียว (SQLite ไม่ติดจำนวน bound parameter สูงสุด)
+def in_codes_sql():
+    return "code = ANY(:codes)" if 'DATABASE_URL' in os.environ else "code IN (SELECT value FROM json_each(:codes))"
+
+def in_codes_param(codes):
+    return list(codes) if 'DATABASE_URL' in os.environ else json.dumps(list(codes))
+
+# บันทึกลง entry_changes จากค่าใน entries: หลัง INSERT / ก่อน DELETE ใน transaction เดียวกับ BUMP_VERSION_SQL
+# writer ทุกตัวรอ row lock ของ data_version ก่อน seq จึงเรียงตามลำดับ commit (ไม่มี seq น้อยกว่าโผล่มาทีหลัง)
+def log_changes_sql(op):
+    return (f"INSERT INTO entry_changes (op, code, date, weight_in, weight_out, quality, version, changed_at) "
+            f"SELECT '{op}', code, date, weight_in, weight_out, quality, :version, :now FROM entries "
+            f"WHERE {in_codes_sql()} ORDER BY code")
+
+def log_changes_params(version, codes):
+    return {'version': version, 'now': int(time.time()), 'codes': in_codes_param(codes)}
+
+def bump_version_params():
+    return {'now': int(time.time())}
+
+def get_data_version():
+    rows = fetch_all("SELECT version, updated_at FROM data_version WHERE id = 1")
+    return (int(rows[0][0]), int(rows[0][1])) if rows else (0, 0)
+
+class ReadReplica:
+    def __init__(self, retry_seconds):
+        self.retry_seconds = retry_seconds
+        self.down_until = 0.0
+        self.reads = 0
+        self.lagging = 0
+        self.unavailable = 0
+        self.lock = threading.Lock()
+
+    def usable(self, min_version):
+        # เรียกใน request ที่ตั้ง g.read_replica แล้ว: replica ต่อได้และมีข้อมูลถึง min_version หรือยัง
+        with self.lock:
+            if time.monotonic() < self.down_until:
+                self.unavailable += 1
+                return False
         try:
-            engine = create_engine(os.environ['DATABASE_URL'])
-            Session = sessionmaker(bind=engine)
-            print("Connected to PostgreSQL")
-            return Session
+            version = get_data_version()[0]
         except Exception as e:
-            print(f"PostgreSQL error: {e}")
-            return None
+            with self.lock:
+                self.down_until = time.monotonic() + self.retry_seconds
+                self.unavailable += 1
+            print(f"Read replica unavailable, using primary for {self.retry_seconds}s: {e}")
+            return False
+        with self.lock:
+            if version < min_version:
+                self.lagging += 1
+                return False
+            self.reads += 1
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {'configured': int(read_replica_configured()), 'reads': self.reads, 'lagging': self.lagging,
+                    'unavailable': self.unavailable, 'down': int(time.monotonic() < self.down_until)}
+
+read_replica = ReadReplica(READ_REPLICA_RETRY)
+
+def use_read_replica():
+    if not read_replica_configured():
+        return False
+    g.read_replica = True
+    g.read_replica = read_replica.usable(session.get('write_version', 0))
+    return g.read_replica
+
+def remember_write(version):
+    # read-your-writes: request ถัดไปของผู้ใช้คนนี้อ่าน replica ได้เมื่อ replica มี version นี้แล้ว
+    if read_replica_configured() and has_request_context():
+        session['write_version'] = max(session.get('write_version', 0), version)
+
+# ETag / Last-Modified ผูกกับ data_version และ build ปัจจุบัน (deploy ใหม่ = ETag ใหม่ แม้ข้อมูลไม่เปลี่ยน)
+ETAG_SALT = os.environ.get('RENDER_GIT_COMMIT', '')[:12] or str(int(os.path.getmtime(__file__)))
+
+def version_validators(version, updated_at, *parts):
+    digest = hashlib.sha1('|'.join([ETAG_SALT, *map(str, parts)]).encode('utf-8')).hexdigest()[:16]
+    return f'v{version}-{digest}', datetime.fromtimestamp(updated_at, timezone.utc)
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def not_modified(etag, last_modified):
+    # มี flash ค้างอยู่ต้อง render ใหม่เสมอ ไม่งั้นข้อความจะค้างไปโผล่หน้าอื่น
+    if '_flashes' in session:
+        return None
+    if request.if_none_match:
+        matched = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since:
+        matched = last_modified <= request.if_modified_since
     else:
-        try:
-            conn = sqlite3.connect('database.db')
-            print("Connected to SQLite")
-            return conn
-        except Exception as e:
-            print(f"SQLite error: {e}")
-            return None
+        matched = False
+    if not matched:
+        return None
+    return set_validators(Response(status=304), etag, last_modified)
+
+def backfill_code_counters_postgres(session):
+    # ใช้ครั้งเดียวตอนสร้าง code_counters จากข้อมูลเดิม
+    if session.execute(text("SELECT 1 FROM code_counters LIMIT 1")).fetchone() is None:
+        counters = build_code_counters(row[0] for row in session.execute(text("SELECT code FROM entries")))
+        if counters:
+            session.execute(text("INSERT INTO code_counters (base_code, last_num) VALUES (:base, :num)"),
+                            [{'base': base, 'num': num} for base, num in counters.items()])
+
+def backfill_code_counters_sqlite(db):
+    if db.execute("SELECT 1 FROM code_counters LIMIT 1").fetchone() is None:
+        counters = build_code_counters(row[0] for row in db.execute("SELECT code FROM entries").fetchall())
+        db.executemany("INSERT INTO code_counters (base_code, last_num) VALUES (?, ?)", counters.items())
+
+def seed_admin_postgres(session):
+    if session.execute(text("SELECT 1 FROM users WHERE username = 'admin'")).fetchone() is None:
+        session.execute(text("INSERT INTO users (username, password_hash) VALUES ('admin', :pw)"),
+                        {'pw': generate_password_hash('password123', PASSWORD_HASH_METHOD)})
+
+def seed_admin_sqlite(db):
+    if db.execute("SELECT 1 FROM users WHERE username = 'admin'").fetchone() is None:
+        db.execute("INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)",
+                   ('admin', generate_password_hash('password123', PASSWORD_HASH_METHOD)))
+
+# ค้นหารหัสตัวอย่าง: ขึ้นต้นด้วย (prefix) ใช้ B-tree แบบไม่สนตัวพิมพ์เล็ก/ใหญ่ ส่วนค้นหาบางส่วนของรหัส (contains)
+# ใช้ pg_trgm บน PostgreSQL และ FTS5 trigram บน SQLite
+def create_code_search_postgres(session):
+    session.execute(text("CREATE INDEX IF NOT EXISTS idx_entries_code_lower ON entries (lower(code) text_pattern_ops)"))
+    # CREATE EXTENSION ต้องมีสิทธิ์ ถ้าไม่มี การค้นหาแบบ contains ยังใช้ได้แต่เป็น seq scan
+    try:
+        with session.begin_nested():
+            session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            session.execute(text("CREATE INDEX IF NOT EXISTS idx_entries_code_trgm ON entries USING gin (code gin_trgm_ops)"))
+    except Exception as e:
+        print(f"pg_trgm not available, substring search will scan entries: {e}")
+
+def create_code_search_sqlite(db):
+    db.execute("CREATE INDEX IF NOT EXISTS idx_entries_code_nocase ON entries (code COLLATE NOCASE)")
+    try:
+        # external content ผูกกับ rowid ของ entries (ถ้าสั่ง VACUUM ต้อง rebuild ตารางนี้ใหม่)
+        db.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS entries_code_fts
+                      USING fts5(code, content='entries', content_rowid='rowid', tokenize='trigram')""")
+    except sqlite3.OperationalError as e:
+        print(f"FTS5 trigram not available, substring search will scan entries: {e}")
+        return
+    db.execute("""CREATE TRIGGER IF NOT EXISTS entries_code_fts_ai AFTER INSERT ON entries BEGIN
+                      INSERT INTO entries_code_fts (rowid, code) VALUES (new.rowid, new.code);
+                  END""")
+    db.execute("""CREATE TRIGGER IF NOT EXISTS entries_code_fts_ad AFTER DELETE ON entries BEGIN
+                      INSERT INTO entries_code_fts (entries_code_fts, rowid, code) VALUES ('delete', old.rowid, old.code);
+                  END""")
+    db.execute("""CREATE TRIGGER IF NOT EXISTS entries_code_fts_au AFTER UPDATE OF code ON entries BEGIN
+                      INSERT INTO entries_code_fts (entries_code_fts, rowid, code) VALUES ('delete', old.rowid, old.code);
+                      INSERT INTO entries_code_fts (rowid, code) VALUES (new.rowid, new.code);
+                  END""")
+    db.execute("INSERT INTO entries_code_fts (entries_code_fts) VALUES ('rebuild')")
+
+# Migration ของ schema: (เวอร์ชัน, คำอธิบาย, ขั้นตอน PostgreSQL, ขั้นตอน SQLite)
+# ขั้นตอนเป็น list ของ SQL หรือฟังก์ชันที่รับ session/connection; เพิ่มขั้นใหม่ต่อท้ายเสมอ ห้ามแก้ขั้นที่ deploy ไปแล้ว
+# ทุกขั้นต้องรันบนฐานข้อมูลที่สร้างก่อนมี schema_version ได้ (ใช้ IF NOT EXISTS / ตรวจสอบก่อนแก้)
+MIGRATIONS = [
+    (1, 'users and entries tables', [
+        """CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(80) UNIQUE NOT NULL,
+            password_hash VARCHAR(120) NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS entries (
+            code VARCHAR(50) PRIMARY KEY,
+            date DATE,
+            weight_in NUMERIC,
+            weight_out NUMERIC,
+            quality NUMERIC
+        )""",
+    ], [
+        """CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS entries (
+            code TEXT PRIMARY KEY,
+            date DATE,
+            weight_in REAL,
+            weight_out REAL,
+            quality REAL
+        )""",
+    ]),
+    # ฐานข้อมูลเก่าเก็บวันที่เป็นข้อความ dd/mm/YYYY
+    (2, 'entries.date as DATE / ISO text', migrate_entry_dates_postgres, migrate_entry_dates_sqlite),
+    # index สำหรับแบ่งหน้า /list ตามวันที่/คุณภาพ
+    (3, 'keyset indexes for /list', [
+        "CREATE INDEX IF NOT EXISTS idx_entries_date_code ON entries (date, code)",
+        "CREATE INDEX IF NOT EXISTS idx_entries_quality_code ON entries (quality, code)",
+    ], [
+        "CREATE INDEX IF NOT EXISTS idx_entries_date_code ON entries (date, code)",
+        "CREATE INDEX IF NOT EXISTS idx_entries_quality_code ON entries (quality, code)",
+    ]),
+    # ตัวนับเลขลำดับต่อรหัสตัวอย่าง (BASE -> N ล่าสุด)
+    (4, 'code_counters', [
+        "CREATE TABLE IF NOT EXISTS code_counters (base_code VARCHAR(50) PRIMARY KEY, last_num INTEGER NOT NULL)",
+        backfill_code_counters_postgres,
+    ], [
+        "CREATE TABLE IF NOT EXISTS code_counters (base_code TEXT PRIMARY KEY, last_num INTEGER NOT NULL)",
+        backfill_code_counters_sqlite,
+    ]),
+    # เลขเวอร์ชันของข้อมูล (เพิ่มทุกครั้งที่มีการเพิ่ม/ลบ) ใช้ทำ ETag และ cache ไฟล์ export
+    (5, 'data_version', [
+        "CREATE TABLE IF NOT EXISTS data_version (id INTEGER PRIMARY KEY, version BIGINT NOT NULL, updated_at BIGINT NOT NULL)",
+        "INSERT INTO data_version (id, version, updated_at) VALUES (1, 1, EXTRACT(EPOCH FROM now())::BIGINT) ON CONFLICT (id) DO NOTHING",
+    ], [
+        "CREATE TABLE IF NOT EXISTS data_version (id INTEGER PRIMARY KEY, version INTEGER NOT NULL, updated_at INTEGER NOT NULL)",
+        "INSERT OR IGNORE INTO data_version (id, version, updated_at) VALUES (1, 1, CAST(strftime('%s', 'now') AS INTEGER))",
+    ]),
+    # hash ของ werkzeug (scrypt) ยาวเกิน 120 ตัวอักษร
+    (6, 'widen users.password_hash', [
+        "ALTER TABLE users ALTER COLUMN password_hash TYPE VARCHAR(255)",
+    ], []),
+    (7, 'admin user', [seed_admin_postgres], [seed_admin_sqlite]),
+    (8, 'code search indexes', create_code_search_postgres, create_code_search_sqlite),
+    # log การเพิ่ม/ลบแบบ append-only สำหรับ /changes เริ่มด้วยแถวที่มีอยู่แล้วทั้งหมดเป็น 'insert'
+    # ระบบปลายทางจึงเริ่มจาก after=0 ได้โดยไม่ต้องโหลด /export ก่อน
+    (9, 'entry change log', [
+        """CREATE TABLE IF NOT EXISTS entry_changes (
+            seq BIGSERIAL PRIMARY KEY,
+            op VARCHAR(10) NOT NULL,
+            code VARCHAR(50) NOT NULL,
+            date DATE,
+            weight_in NUMERIC,
+            weight_out NUMERIC,
+            quality NUMERIC,
+            version BIGINT NOT NULL,
+            changed_at BIGINT NOT NULL
+        )""",
+        """INSERT INTO entry_changes (op, code, date, weight_in, weight_out, quality, version, changed_at)
+            SELECT 'insert', code, date, weight_in, weight_out, quality,
+                   (SELECT version FROM data_version WHERE id = 1), EXTRACT(EPOCH FROM now())::BIGINT
+            FROM entries ORDER BY code""",
+    ], [
+        """CREATE TABLE IF NOT EXISTS entry_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            op TEXT NOT NULL,
+            code TEXT NOT NULL,
+            date DATE,
+            weight_in REAL,
+            weight_out REAL,
+            quality REAL,
+            version INTEGER NOT NULL,
+            changed_at INTEGER NOT NULL
+        )""",
+        """INSERT INTO entry_changes (op, code, date, weight_in, weight_out, quality, version, changed_at)
+            SELECT 'insert', code, date, weight_in, weight_out, quality,
+                   (SELECT version FROM data_version WHERE id = 1), CAST(strftime('%s', 'now') AS INTEGER)
+            FROM entries ORDER BY code""",
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+SCHEMA_VERSION_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at BIGINT NOT NULL
+    )
+"""
+# key ของ pg_advisory_xact_lock กันหลาย worker รัน migration พร้อมกัน
+SCHEMA_LOCK_KEY = 7310945
+
+def pending_migrations(current, backend):
+    for version, name, postgres, sqlite in MIGRATIONS:
+        if version > current:
+            steps = postgres if backend == 'postgresql' else sqlite
+            yield version, name, steps if isinstance(steps, list) else [steps]
 
 def init_db():
+    # รัน migration ที่ยังไม่ได้รัน: ถ้า schema เป็นเวอร์ชันล่าสุดแล้วจะจบที่ SELECT เดียว ไม่ล็อก ไม่เขียนอะไร
     db = get_db()
     if db is None:
         print("DB connection failed!")
@@ -73,81 +913,295 @@ def init_db():
         if 'DATABASE_URL' in os.environ:
             # PostgreSQL
             with db() as session:
-                # สร้างตาราง users
-                session.execute(text("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        id SERIAL PRIMARY KEY,
-                        username VARCHAR(80) UNIQUE NOT NULL,
-                        password_hash VARCHAR(120) NOT NULL
-                    )
-                """))
-                # สร้างตาราง entries
-                session.execute(text("""
-                    CREATE TABLE IF NOT EXISTS entries (
-                        code VARCHAR(50) PRIMARY KEY,
-                        date VARCHAR(20),
-                        weight_in NUMERIC,
-                        weight_out NUMERIC,
-                        quality NUMERIC
-                    )
-                """))
-                # เพิ่ม admin ถ้ายังไม่มี
-                result = session.execute(text("SELECT 1 FROM users WHERE username = 'admin'"))
-                if not result.fetchone():
-                    pw_hash = generate_password_hash('password123')
-                    session.execute(text("INSERT INTO users (username, password_hash) VALUES ('admin', :pw)"), {'pw': pw_hash})
-                session.commit()
+                try:
+                    current = session.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+                except Exception:
+                    current = 0
+            if current < SCHEMA_VERSION:
+                with db() as session:
+                    # ล็อกถึงจบ transaction; worker อื่นรอแล้วจะเห็นว่ารันไปแล้ว (DDL ของ PostgreSQL อยู่ใน transaction ได้)
+                    session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': SCHEMA_LOCK_KEY})
+                    session.execute(text(SCHEMA_VERSION_TABLE))
+                    current = session.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+                    for version, name, steps in pending_migrations(current, 'postgresql'):
+                        for step in steps:
+                            if callable(step):
+                                step(session)
+                            else:
+                                session.execute(text(step))
+                        session.execute(text("INSERT INTO schema_version (version, name, applied_at) VALUES (:version, :name, :now)"),
+                                        {'version': version, 'name': name, 'now': int(time.time())})
+                        print(f"Applied migration {version}: {name}")
+                    session.commit()
         else:
             # SQLite
-            cursor = db.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL
-                )
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS entries (
-                    code TEXT PRIMARY KEY,
-                    date TEXT,
-                    weight_in REAL,
-                    weight_out REAL,
-                    quality REAL
-                )
-            """)
-            cursor.execute("SELECT 1 FROM users WHERE username = 'admin'")
-            if not cursor.fetchone():
-                pw_hash = generate_password_hash('password123')
-                cursor.execute("INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)", ('admin', pw_hash))
-            db.commit()
-            db.close()
+            try:
+                current = db.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+            except sqlite3.OperationalError:
+                current = 0
+            if current < SCHEMA_VERSION:
+                # BEGIN IMMEDIATE ล็อกการเขียนทั้งไฟล์ worker อื่นจะรอจนกว่าจะ commit
+                db.execute("BEGIN IMMEDIATE")
+                db.execute(SCHEMA_VERSION_TABLE)
+                current = db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+                for version, name, steps in pending_migrations(current, 'sqlite'):
+                    for step in steps:
+                        if callable(step):
+                            step(db)
+                        else:
+                            db.execute(step)
+                    db.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                               (version, name, int(time.time())))
+                    print(f"Applied migration {version}: {name}")
+                db.commit()
         print("DB initialized successfully!")
     except Exception as e:
         print(f"DB init error: {e}")
 
-init_db()
-with app.app_context():
-    init_db()
+# สถานะ: ตารางกลุ่มคุณภาพชุดเดียว ใช้ทั้ง badge ในหน้า /list และข้อความใน export
+# (ขอบล่างของกลุ่ม, ข้อความ, class ของ badge) เรียงจากน้อยไปมาก กลุ่มแรกไม่มีขอบล่าง
+QUALITY_BUCKETS = [
+    (None, 'ส่งไปกลุ่ม < 50%', 'bg-danger'),
+    (50, 'ส่งไปกลุ่ม 50 - 54.9%', 'bg-warning'),
+    (55, 'ส่งไปกลุ่ม 55 - 59.9%', 'bg-info'),
+    (60, 'ส่งไปกลุ่ม 60 - 64.9%', 'bg-primary'),
+    (65, 'ส่งไปกลุ่ม 65 - 67.9%', 'bg-success'),
+    (68, 'ส่งไปกลุ่ม 68 - 69.9%', 'bg-dark'),
+    (70, 'ส่งไปกลุ่ม > 70%', 'bg-success'),
+]
+QUALITY_UNKNOWN = ('ไม่ระบุ', 'bg-secondary')
+
+QUALITY_EDGES = [edge for edge, _, _ in QUALITY_BUCKETS[1:]]
+# ตำแหน่งสุดท้าย (-1) คือ "ไม่ระบุ" สำหรับค่า NULL/NaN
+STATUS_LABELS = [label for _, label, _ in QUALITY_BUCKETS] + [QUALITY_UNKNOWN[0]]
+STATUS_BADGES = (
+    [f'<span class="badge {badge}">{label}</span>' for _, label, badge in QUALITY_BUCKETS]
+    + [f'<span class="badge {QUALITY_UNKNOWN[1]}">{QUALITY_UNKNOWN[0]}</span>']
+)
+
+def quality_buckets(qualities):
+    # แปลงค่าคุณภาพทั้งคอลัมน์เป็นเลขกลุ่มในครั้งเดียวด้วย searchsorted (NULL/NaN -> -1)
+    # import numpy เฉพาะตอนใช้ ไม่ให้ทุก worker ต้องโหลดตอน start
+    import numpy as np
+    values = np.asarray(qualities, dtype=float)
+    buckets = np.searchsorted(QUALITY_EDGES, values, side='right')
+    buckets[np.isnan(values)] = -1
+    return buckets
+
+def status_labels(qualities):
+    import numpy as np
+    return np.asarray(STATUS_LABELS, dtype=object)[quality_buckets(qualities)]
+
+def status_badges(qualities):
+    import numpy as np
+    return np.asarray(STATUS_BADGES, dtype=object)[quality_buckets(qualities)]
 
-# สถานะ (เหมือนเดิม)
 def get_status(quality):
-    if quality is None:
-        return '<span class="badge bg-secondary">ไม่ระบุ</span>'
-    elif quality < 50:
-        return '<span class="badge bg-danger">ส่งไปกลุ่ม < 50%</span>'
-    elif 50 <= quality < 55:
-        return '<span class="badge bg-warning">ส่งไปกลุ่ม 50 - 54.9%</span>'
-    elif 55 <= quality < 60:
-        return '<span class="badge bg-info">ส่งไปกลุ่ม 55 - 59.9%</span>'
-    elif 60 <= quality < 65:
-        return '<span class="badge bg-primary">ส่งไปกลุ่ม 60 - 64.9%</span>'
-    elif 65 <= quality < 68:
-        return '<span class="badge bg-success">ส่งไปกลุ่ม 65 - 67.9%</span>'
-    elif 68 <= quality < 70:
-        return '<span class="badge bg-dark">ส่งไปกลุ่ม 68 - 69.9%</span>'
+    return status_badges([quality])[0]
+
+def clean_status(quality):
+    return status_labels([quality])[0]
+
+# จำกัดการตรวจรหัสผ่านพร้อมกัน: ช่วงเปลี่ยนกะที่ทุกคน login พร้อมกัน การ hash (ตั้งใจให้กิน CPU)
+# ทำได้ครั้งละไม่เกิน LOGIN_HASH_WORKERS ที่เหลือต่อคิวรอ (ไม่กิน CPU) ได้นานสุด LOGIN_HASH_WAIT วินาที
+# เกินนั้นจึงตอบ 503 CPU ของ worker จึงยังเหลือให้งานบันทึกข้อมูลเสมอ
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+LOGIN_MAX_FAILURES = _env_int('LOGIN_MAX_FAILURES', 5)
+LOGIN_MAX_FAILURES_IP = _env_int('LOGIN_MAX_FAILURES_IP', 30)
+LOGIN_THROTTLE_WINDOW = _env_int('LOGIN_THROTTLE_WINDOW', 300)
+# หลัง reverse proxy (เช่น Render) remote_addr คือ IP ของ proxy จึงอ่าน IP ผู้ใช้จาก X-Forwarded-For ตามจำนวน proxy ที่เชื่อถือ
+# ค่าเริ่มต้น 0: ถ้าไม่มี proxy จริง client จะปลอม X-Forwarded-For หลบการจำกัดต่อ IP ได้ (ตั้งใน render.yaml)
+TRUSTED_PROXIES = _env_int('TRUSTED_PROXIES', 0)
+if TRUSTED_PROXIES > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+# บีบอัด response ที่เป็นข้อความ (HTML/JSON/CSV) ตาม Accept-Encoding ของ browser: brotli ถ้าติดตั้ง package brotli ไว้
+# ไม่งั้น gzip ตาราง /list ซ้ำกันเกือบทั้งหน้าจึงเล็กลงมากกว่า 10 เท่า ช่วยเครื่องหน้างานที่ใช้ Wi-Fi ช้า
+# xlsx/parquet บีบอัดอยู่แล้ว และ SSE (text/event-stream) ต้องส่งทันทีทีละ event จึงไม่อยู่ในรายการ
+COMPRESS_MIMETYPES = {'text/html', 'application/json', 'text/csv', 'text/plain'}
+COMPRESS_MIN_BYTES = _env_int('COMPRESS_MIN_BYTES', 1024)
+COMPRESS_LEVEL = _env_int('COMPRESS_LEVEL', 6)
+COMPRESS_BROTLI_QUALITY = _env_int('COMPRESS_BROTLI_QUALITY', 5)
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def response_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br'] and accepted['br'] >= accepted['gzip']:
+        return 'br'
+    return 'gzip' if accepted['gzip'] else None
+
+def make_compressor(encoding):
+    # คืน (compress, flush, finish) ให้ใช้แบบเดียวกันทั้งสองรูปแบบ
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+def compress_chunks(chunks, source, encoding):
+    # flush ทุก chunk ให้ client ได้ข้อมูลต่อเนื่อง (CSV export) ไม่ต้องรอจนจบไฟล์
+    compress, flush, finish = make_compressor(encoding)
+    try:
+        for chunk in chunks:
+            data = compress(chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        # ปิด iterable เดิม (เช่น tee ของ export cache ต้องรู้ว่าส่งไม่ครบ)
+        close = getattr(source, 'close', None)
+        if close is not None:
+            close()
+
+@app.after_request
+def compress_response(response):
+    if response.mimetype not in COMPRESS_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers):
+        return response
+    encoding = response_encoding()
+    if encoding is None:
+        return response
+    if response.is_streamed or response.direct_passthrough:
+        # ไม่รู้ขนาดล่วงหน้า (stream หรือ send_file) บีบอัดทีละ chunk เสมอ
+        source = response.response
+        response.response = compress_chunks(response.iter_encoded(), source, encoding)
+        response.direct_passthrough = False
+        response.headers.pop('Content-Length', None)
+        response.headers.pop('Accept-Ranges', None)
     else:
-        return '<span class="badge bg-success">ส่งไปกลุ่ม > 70%</span>'
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_BYTES:
+            return response
+        compress, _, finish = make_compressor(encoding)
+        response.set_data(compress(data) + finish())
+    response.headers['Content-Encoding'] = encoding
+    # ETag แบบ strong ระบุ byte ที่ส่งจริง ตัวที่บีบอัดแล้วจึงต้องเป็น weak
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+class LoginBusy(Exception):
+    pass
+
+class PasswordHasher:
+    def __init__(self, method, workers, wait):
+        self.method = method
+        self.workers = workers
+        self.wait = wait
+        self.slots = threading.BoundedSemaphore(workers)
+        self.reference_hash = None
+        self.verified = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.active = 0
+        self.waiting = 0
+        self.lock = threading.Lock()
+
+    def current_prefix(self):
+        # hash อ้างอิงสร้างครั้งเดียวเมื่อใช้ครั้งแรก ใช้ทั้งดูพารามิเตอร์ปัจจุบันและตรวจกับผู้ใช้ที่ไม่มีอยู่ (เวลาตอบเท่ากัน)
+        if self.reference_hash is None:
+            self.reference_hash = generate_password_hash(secrets.token_hex(16), self.method)
+        return self.reference_hash.split('$', 1)[0]
+
+    def _verify(self, password_hash, password):
+        prefix = self.current_prefix()
+        if password_hash is None:
+            check_password_hash(self.reference_hash, password)
+            return False, None
+        if not check_password_hash(password_hash, password):
+            return False, None
+        # hash ที่ใช้พารามิเตอร์เก่ากว่าปัจจุบัน สร้างใหม่ตอนนี้เลยเพราะมีรหัสผ่านจริงอยู่ในมือ
+        if password_hash.split('$', 1)[0] != prefix:
+            return True, generate_password_hash(password, self.method)
+        return True, None
+
+    def verify(self, password_hash, password):
+        # คืน (ถูกต้องหรือไม่, hash ใหม่ถ้าควรอัปเกรด) หรือ LoginBusy ถ้ารอคิวนานเกิน self.wait วินาที
+        with self.lock:
+            self.waiting += 1
+        try:
+            acquired = self.slots.acquire(timeout=self.wait)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+        if not acquired:
+            with self.lock:
+                self.rejected += 1
+            raise LoginBusy()
+        try:
+            with self.lock:
+                self.active += 1
+            ok, new_hash = self._verify(password_hash, password)
+        finally:
+            with self.lock:
+                self.active -= 1
+            self.slots.release()
+        with self.lock:
+            self.verified += 1
+            if new_hash:
+                self.rehashed += 1
+        return ok, new_hash
+
+    def stats(self):
+        with self.lock:
+            return {'workers': self.workers, 'active': self.active, 'waiting': self.waiting,
+                    'verified': self.verified, 'rejected': self.rejected, 'rehashed': self.rehashed}
+
+password_hasher = PasswordHasher(PASSWORD_HASH_METHOD, _env_int('LOGIN_HASH_WORKERS', 2), _env_int('LOGIN_HASH_WAIT', 5))
+
+class LoginThrottle:
+    # นับครั้งที่ login ผิดต่อ key ในช่วง window วินาที (ต่อ worker) ถ้าเกินกำหนดปฏิเสธโดยไม่ต้อง hash
+    def __init__(self, max_failures, window, max_keys=10000):
+        self.max_failures = max_failures
+        self.window = window
+        self.max_keys = max_keys
+        self.failures = OrderedDict()
+        self.lock = threading.Lock()
+
+    def retry_after(self, key):
+        if self.max_failures <= 0:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            times = [t for t in self.failures.get(key, ()) if now - t < self.window]
+            if len(times) < self.max_failures:
+                return 0
+            return int(times[-self.max_failures] + self.window - now) + 1
+
+    def failure(self, key):
+        now = time.monotonic()
+        with self.lock:
+            times = [t for t in self.failures.pop(key, ()) if now - t < self.window]
+            self.failures[key] = times[-self.max_failures:] + [now] if self.max_failures > 0 else [now]
+            while len(self.failures) > self.max_keys:
+                self.failures.popitem(last=False)
+
+    def reset(self, key):
+        with self.lock:
+            self.failures.pop(key, None)
+
+login_throttle_user = LoginThrottle(LOGIN_MAX_FAILURES, LOGIN_THROTTLE_WINDOW)
+login_throttle_ip = LoginThrottle(LOGIN_MAX_FAILURES_IP, LOGIN_THROTTLE_WINDOW)
+
+def update_password_hash(user_id, old_hash, new_hash):
+    # เทียบ hash เดิมด้วย กันเขียนทับถ้ามีการเปลี่ยนรหัสผ่านพร้อมกัน
+    db = get_db()
+    if 'DATABASE_URL' in os.environ:
+        with db() as session:
+            session.execute(text("UPDATE users SET password_hash = :new WHERE id = :id AND password_hash = :old"),
+                            {'new': new_hash, 'id': user_id, 'old': old_hash})
+            session.commit()
+    else:
+        db.execute("UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?", (new_hash, user_id, old_hash))
+        db.commit()
+    user_cache.invalidate(user_id)
 
 # หน้า Login
 @app.route('/login', methods=['GET', 'POST'])
@@ -157,81 +1211,41 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
+        ip = request.remote_addr or ''
+        retry_after = max(login_throttle_user.retry_after(username), login_throttle_ip.retry_after(ip))
+        if retry_after:
+            flash(f'เข้าสู่ระบบผิดหลายครั้งเกินไป กรุณาลองใหม่ในอีก {retry_after} วินาที', 'danger')
+            return render_template('login.html'), 429, {'Retry-After': str(retry_after)}
         db = get_db()
         try:
             if 'DATABASE_URL' in os.environ:
                 with db() as session:
                     result = session.execute(text("SELECT id, username, password_hash FROM users WHERE username = :username"), {'username': username})
                     user_row = result.fetchone()
-                    if user_row and check_password_hash(user_row[2], password):
-                        user = User(user_row[0], user_row[1], user_row[2])
-                        login_user(user)
-                        return redirect(url_for('index'))
-                    flash('ชื่อผู้ใช้หรือรหัสผ่านไม่ถูกต้อง!', 'danger')
             else:
                 cursor = db.cursor()
                 cursor.execute("SELECT id, username, password_hash FROM users WHERE username = ?", (username,))
                 user_row = cursor.fetchone()
-                if user_row and check_password_hash(user_row[2], password):
-                    user = User(user_row[0], user_row[1], user_row[2])
-                    login_user(user)
-                    db.close()
-                    return redirect(url_for('index'))
-                flash('ชื่อผู้ใช้หรือรหัสผ่านไม่ถูกต้อง!', 'danger')
-                db.close()
+            ok, new_hash = password_hasher.verify(user_row[2] if user_row else None, password)
+            if ok:
+                password_hash = user_row[2]
+                if new_hash:
+                    update_password_hash(user_row[0], password_hash, new_hash)
+                    password_hash = new_hash
+                login_throttle_user.reset(username)
+                user = User(user_row[0], user_row[1], password_hash)
+                user_cache.put(user)
+                login_user(user)
+                return redirect(url_for('index'))
+            login_throttle_user.failure(username)
+            login_throttle_ip.failure(ip)
+            flash('ชื่อผู้ใช้หรือรหัสผ่านไม่ถูกต้อง!', 'danger')
+        except LoginBusy:
+            flash('มีผู้เข้าสู่ระบบพร้อมกันจำนวนมาก กรุณาลองใหม่อีกครั้งในอีกสักครู่', 'danger')
+            return render_template('login.html'), 503, {'Retry-After': '2'}
         except Exception as e:
             flash(f'เกิดข้อผิดพลาด: {e}', 'danger')
-    # HTML Login Form
-    login_html = """
-    <!DOCTYPE html>
-    <html lang="th">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-        <title>เข้าสู่ระบบ</title>
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet">
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.0/font/bootstrap-icons.css" rel="stylesheet">
-        <style>body { background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%); min-height: 100vh; }</style>
-    </head>
-    <body>
-    <div class="container py-5">
-        <div class="row justify-content-center">
-            <div class="col-md-6">
-                <div class="card p-4">
-                    <h2 class="text-center mb-4"><i class="bi bi-shield-lock"></i> เข้าสู่ระบบ</h2>
-                    {% with messages = get_flashed_messages(with_categories=true) %}
-                        {% if messages %}
-                            {% for category, message in messages %}
-                                <div class="alert alert-{{ 'danger' if category == 'danger' else 'success' }} alert-dismissible fade show">
-                                    {{ message }}
-                                    <button type="button" class="btn-close" data-bs-dismiss="alert"></button>
-                                </div>
-                            {% endfor %}
-                        {% endif %}
-                    {% endwith %}
-                    <form method="post">
-                        <div class="mb-3">
-                            <label class="form-label">ชื่อผู้ใช้</label>
-                            <input type="text" name="username" class="form-control" required>
-                        </div>
-                        <div class="mb-3">
-                            <label class="form-label">รหัสผ่าน</label>
-                            <input type="password" name="password" class="form-control" required>
-                        </div>
-                        <button type="submit" class="btn btn-primary w-100">เข้าสู่ระบบ</button>
-                    </form>
-                    <div class="text-center mt-3">
-                        <small>Default: admin / password123</small>
-                    </div>
-                </div>
-            </div>
-        </div>
-    </div>
-    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js"></script>
-    </body>
-    </html>
-    """
-    return render_template_string(login_html)
+    return render_template('login.html')
 
 # หน้า Logout
 @app.route('/logout')
@@ -242,7 +1256,6 @@ def logout():
     return redirect(url_for('login'))
 
 # หน้าแรก (protected)
-from datetime import datetime
 
 @app.route('/', methods=['GET', 'POST'])
 @login_required
@@ -256,61 +1269,63 @@ def index():
         if not base_code:
             flash("กรุณาระบุรหัสตัวอย่าง!", "danger")
         else:
-            date = request.form.get('date') or None
+            try:
+                date = db_date(request.form.get('date'))
+            except ValueError as e:
+                flash(str(e), 'danger')
+                return render_form(prefill)
             weight_in = float(request.form['weight_in']) if request.form.get('weight_in') else None
             weight_out = float(request.form['weight_out']) if request.form.get('weight_out') else None
             quality = float(request.form['quality']) if request.form.get('quality') else None
 
             db = get_db()
             try:
-                cursor = db.cursor() if not 'DATABASE_URL' in os.environ else db()
-                if 'DATABASE_URL' in os.environ:
-                    cursor.execute(text("SELECT code FROM entries WHERE code LIKE :pattern ORDER BY code"), {'pattern': f"{base_code}-%"})
-                    existing_codes = [row[0] for row in cursor.fetchall()]
-                else:
-                    cursor.execute("SELECT code FROM entries WHERE code LIKE ? ORDER BY code", (f"{base_code}-%",))
-                    existing_codes = [row[0] for row in cursor.fetchall()]
-
-                next_num = 1
-                while f"{base_code}-{next_num}" in existing_codes:
-                    next_num += 1
-                full_code = f"{base_code}-{next_num}"
-
                 if 'DATABASE_URL' in os.environ:
-                    cursor.execute(text("INSERT INTO entries (code, date, weight_in, weight_out, quality) VALUES (:code, :date, :wi, :wo, :q)"), {
-                        'code': full_code, 'date': date, 'wi': weight_in, 'wo': weight_out, 'q': quality
-                    })
-                    cursor.commit()
+                    with db() as session:
+                        session.execute(text(BUMP_VERSION_SQL), bump_version_params())
+                        version = session.execute(text(VERSION_SQL)).scalar_one()
+                        next_num = session.execute(text(NEXT_SUFFIX_SQL), {'base': base_code, 'n': 1}).scalar_one()
+                        full_code = f"{base_code}-{next_num}"
+                        session.execute(text("INSERT INTO entries (code, date, weight_in, weight_out, quality) VALUES (:code, :date, :wi, :wo, :q)"), {
+                            'code': full_code, 'date': date, 'wi': weight_in, 'wo': weight_out, 'q': quality
+                        })
+                        session.execute(text(log_changes_sql('insert')), log_changes_params(version, [full_code]))
+                        session.commit()
                 else:
+                    cursor = db.cursor()
+                    cursor.execute(BUMP_VERSION_SQL, bump_version_params())
+                    version = cursor.execute(VERSION_SQL).fetchone()[0]
+                    next_num = cursor.execute(NEXT_SUFFIX_SQL, {'base': base_code, 'n': 1}).fetchone()[0]
+                    full_code = f"{base_code}-{next_num}"
                     cursor.execute("INSERT INTO entries VALUES (?, ?, ?, ?, ?)", (full_code, date, weight_in, weight_out, quality))
+                    cursor.execute(log_changes_sql('insert'), log_changes_params(version, [full_code]))
                     db.commit()
+                list_cache.record_write(version, [(full_code, date, quality)])
+                remember_write(version)
 
-                flash(f"บันทึกข้อมูลรหัส <strong>{full_code}</strong> เรียบร้อยแล้ว! <a href='/list' class='alert-link'>ไปหน้ารายการ</a>", "success")
+                flash(Markup("บันทึกข้อมูลรหัส <strong>{}</strong> เรียบร้อยแล้ว! <a href='/list' class='alert-link'>ไปหน้ารายการ</a>").format(full_code), "success")
             except Exception as e:
                 flash(f'เกิดข้อผิดพลาดในการบันทึก: {e}', 'danger')
-            finally:
-                if not 'DATABASE_URL' in os.environ:
-                    db.close()
 
     # Prefill for edit
     if 'code' in request.args:
         code = request.args['code']
+        use_read_replica()
         db = get_db()
         try:
             if 'DATABASE_URL' in os.environ:
                 with db() as session:
-                    result = session.execute(text("SELECT * FROM entries WHERE code = :code"), {'code': code})
+                    result = session.execute(text("SELECT code, date, weight_in, weight_out, quality FROM entries WHERE code = :code"), {'code': code})
                     row = result.fetchone()
             else:
                 cursor = db.cursor()
-                cursor.execute("SELECT * FROM entries WHERE code=?", (code,))
+                cursor.execute("SELECT code, date, weight_in, weight_out, quality FROM entries WHERE code=?", (code,))
                 row = cursor.fetchone()
-                db.close()
             if row:
                 base = code.rsplit('-', 1)[0]
                 prefill = {
                     'base_code': base,
-                    'date': row[1] or '',
+                    'date': format_entry_date(row[1]) or '',
                     'weight_in': row[2] if row[2] is not None else '',
                     'weight_out': row[3] if row[3] is not None else '',
                     'quality': row[4] if row[4] is not None else ''
@@ -321,309 +1336,1517 @@ def index():
     return render_form(prefill)
 
 # ฟอร์ม (เหมือนเดิม)
-def render_form(prefill):
-    flash_html = ""
-    for message, category in get_flashed_messages(with_categories=True):
-        alert_class = "alert-success" if category == "success" else "alert-danger"
-        flash_html += f'<div class="alert {alert_class} alert-dismissible fade show mt-3"><button type="button" class="btn-close" data-bs-dismiss="alert"></button>{message}</div>'
-
-    form_content = f"""
-    <div class="card p-4">
-        <h2 class="text-primary mb-4">เพิ่ม/แก้ไขข้อมูล</h2>
-        {flash_html}
-        <form method="post">
-            <div class="row g-3">
-                <div class="col-md-6">
-                    <label class="form-label"><strong>รหัสตัวอย่าง</strong></label>
-                    <div class="input-group">
-                        <input name="base_code" class="form-control" value="" required placeholder="เช่น L9R3-0711">
-                    </div>
-                    <small class="text-muted">ระบบจะเพิ่มเลขลำดับให้อัตโนมัติ (1,2,3,...)</small>
-                </div>
-                <div class="col-md-6">
-                    <label class="form-label">วันที่</label>
-                    <div class="input-group">
-                        <input name="date" class="form-control datepicker" value="{{prefill['date']}}" placeholder="เช่น 14/11/2568" autocomplete="off">
-                        <span class="input-group-text">
-                            <i class="bi bi-calendar3"></i>
-                        </span>
-                    </div>
-                </div>
-                <div class="col-md-6">
-                    <label class="form-label">น้ำหนักขาเข้า</label>
-                    <input type="number" step="0.01" name="weight_in" class="form-control" value="{{prefill['weight_in']}}">
-                </div>
-                <div class="col-md-6">
-                    <label class="form-label">น้ำหนักขาออก</label>
-                    <input type="number" step="0.01" name="weight_out" class="form-control" value="{{prefill['weight_out']}}">
-                </div>
-                <div class="col-12">
-                    <label class="form-label">คุณภาพ</label>
-                    <input type="number" step="0.01" name="quality" class="form-control" value="{{prefill['quality']}}">
-                </div>
-                <div class="col-12">
-                    <button type="submit" class="btn btn-primary btn-lg px-4">
-                        บันทึกข้อมูล
-                    </button>
-                    <a href="/list" class="btn btn-outline-secondary btn-lg px-4">
-                        ไปหน้ารายการ
-                    </a>
-                </div>
-            </div>
-        </form>
-    </div>
-    """
-
-    return f"""
-    <!DOCTYPE html>
-    <html lang="th">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-        <title>ระบบจัดการตัวอย่าง</title>
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet">
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.0/font/bootstrap-icons.css" rel="stylesheet">
-        <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/flatpickr/dist/flatpickr.min.css">
-        <style>
-            body {{ background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%); min-height: 100vh; }}
-            .container {{ max-width: 1000px; }}
-            .card {{ box-shadow: 0 4px 12px rgba(0,0,0,0.1); border:: none; }}
-        </style>
-    </head>
-    <body>
-    <nav class="navbar navbar-expand-lg navbar-dark bg-primary">
-        <div class="container">
-            <a class="navbar-brand" href="/"> APAC Biosciences</a>
-            <div class="navbar-nav ms-auto">
-                <a class="nav-link" href="/list">รายการ</a>
-                <a class="nav-link" href="/logout">ออกจากระบบ</a>
-            </div>
-        </div>
-    </nav>
-    <div class="container py-5">
-        {form_content}
-    </div>
-    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js"></script>
-    <script src="https://cdn.jsdelivr.net/npm/flatpickr"></script>
-    <script src="https://cdn.jsdelivr.net/npm/flatpickr/dist/l10n/th.js"></script>
-    <script>
-    document.addEventListener('DOMContentLoaded', function() {{
-        flatpickr('.datepicker', {{
-            dateFormat: 'd/m/Y',
-            locale: 'th',
-            defaultDate: 'today',
-            allowInput: true
-        }});
-    }});
-    </script>
-    </body>
-    </html>
-    """
+def render_form(prefill, import_report=None):
+    return render_template('form.html', prefill=prefill, import_report=import_report, import_columns=list(IMPORT_COLUMNS))
+
+# แบ่งหน้า /list แบบ keyset (cursor = ค่าคอลัมน์ที่เรียง + code ของแถวสุดท้าย)
+# ORDER BY/LIMIT ทำใน database และใช้ index (คอลัมน์, code) ทำให้ทุกหน้าเร็วเท่ากันไม่ว่าตารางจะใหญ่แค่ไหน
+LIST_SORT_COLUMNS = ('date', 'code', 'quality')
+LIST_DEFAULT_SORT = 'date'
+LIST_DEFAULT_DIR = 'desc'
+LIST_DEFAULT_PER_PAGE = 50
+LIST_MAX_PER_PAGE = 500
+ENTRY_COLUMNS = ['code', 'date', 'weight_in', 'weight_out', 'quality']
+
+def encode_cursor(value, code):
+    if isinstance(value, Decimal):
+        value = str(value)
+    raw = json.dumps([value, code], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token, sort):
+    # cursor มาจาก URL จึงตรวจและแปลงค่าตามคอลัมน์ที่เรียงให้ครบที่นี่ ค่าที่ใช้ไม่ได้ต้องไม่หลุดไปพังตอน bind ใน database
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        value, code = json.loads(raw.decode('utf-8'))
+        if not isinstance(code, str):
+            raise ValueError('invalid cursor')
+        if sort == 'code' or value is None:
+            return None if sort == 'code' else value, code
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise ValueError('invalid cursor')
+        if sort == 'quality':
+            number = Decimal(str(value))
+            if not number.is_finite():
+                raise ValueError('invalid cursor')
+            # NUMERIC ใน PostgreSQL ต้องเทียบกับ Decimal เพื่อให้ใช้ index ได้
+            return (number if 'DATABASE_URL' in os.environ else float(number)), code
+        value = db_date(value)
+        if value is None:
+            raise ValueError('invalid cursor')
+        return value, code
+    except (ValueError, TypeError, ArithmeticError):
+        raise ValueError('invalid cursor')
+
+SEARCH_MODES = {'prefix': 'ขึ้นต้นด้วย', 'contains': 'มีคำว่า'}
+SEARCH_MAX_LENGTH = 50
+# FTS5 trigram ต้องมีอย่างน้อย 3 ตัวอักษร สั้นกว่านั้นใช้ LIKE แทน
+SEARCH_TRIGRAM_MIN = 3
+_sqlite_code_fts = None
+
+def sqlite_code_fts():
+    global _sqlite_code_fts
+    if _sqlite_code_fts is None:
+        _sqlite_code_fts = bool(fetch_all("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'entries_code_fts'"))
+    return _sqlite_code_fts
+
+def like_escape(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def entry_filters(args):
+    # ตัวกรองช่วงวันที่ ?from=...&to=... (dd/mm/YYYY หรือ YYYY-MM-DD) และค้นหารหัส ?q=...&match=prefix|contains
+    # ส่งลงไปเป็น WHERE ใน SQL (ใช้ร่วมกันทั้ง /list และ /export)
+    conditions, params = [], {}
+    date_from = db_date(args.get('from'))
+    date_to = db_date(args.get('to'))
+    if date_from:
+        conditions.append("date >= :date_from")
+        params['date_from'] = date_from
+    if date_to:
+        conditions.append("date <= :date_to")
+        params['date_to'] = date_to
+    query = (args.get('q') or '').strip()[:SEARCH_MAX_LENGTH]
+    if query:
+        postgres = 'DATABASE_URL' in os.environ
+        if args.get('match') == 'contains':
+            if postgres:
+                conditions.append("code ILIKE :code_like")
+                params['code_like'] = f"%{like_escape(query)}%"
+            elif len(query) >= SEARCH_TRIGRAM_MIN and sqlite_code_fts():
+                conditions.append("rowid IN (SELECT rowid FROM entries_code_fts WHERE entries_code_fts MATCH :code_match)")
+                params['code_match'] = '"' + query.replace('"', '""') + '"'
+            else:
+                conditions.append("code LIKE :code_like ESCAPE '\\'")
+                params['code_like'] = f"%{like_escape(query)}%"
+        elif postgres:
+            conditions.append("lower(code) LIKE :code_like")
+            params['code_like'] = f"{like_escape(query.lower())}%"
+        else:
+            conditions.append("code LIKE :code_like ESCAPE '\\'")
+            params['code_like'] = f"{like_escape(query)}%"
+    return conditions, params
+
+def fetch_entries_page(sort, direction, after, limit, conditions=(), filter_params=None):
+    # แถวที่คอลัมน์เรียงเป็น NULL จะอยู่ท้ายสุดเสมอ (ทั้งสองทิศทาง และทั้ง SQLite/PostgreSQL)
+    # จึงแยก query เป็นช่วง NOT NULL กับช่วง NULL เพื่อให้แต่ละช่วงเป็น range scan บน index
+    op = '>' if direction == 'asc' else '<'
+    order = 'ASC' if direction == 'asc' else 'DESC'
+    select = "SELECT code, date, weight_in, weight_out, quality FROM entries"
+    def where(*extra):
+        clauses = list(conditions) + [clause for clause in extra if clause]
+        return "WHERE " + " AND ".join(clauses) if clauses else ""
+    if sort == 'code':
+        rows = fetch_all(f"{select} {where(f'code {op} :c' if after else None)} ORDER BY code {order} LIMIT :limit",
+                         dict(filter_params or {}, c=after[1] if after else None, limit=limit + 1))
+    else:
+        rows = []
+        in_null_segment = after is not None and after[0] is None
+        if not in_null_segment:
+            params = dict(filter_params or {}, limit=limit + 1)
+            keyset = None
+            if after:
+                keyset = f"({sort}, code) {op} (:v, :c)"
+                params.update(v=after[0], c=after[1])
+            rows = fetch_all(f"{select} {where(f'{sort} IS NOT NULL', keyset)} ORDER BY {sort} {order}, code {order} LIMIT :limit", params)
+        if len(rows) <= limit:
+            params = dict(filter_params or {}, limit=limit + 1 - len(rows))
+            keyset = None
+            if in_null_segment:
+                keyset = f"code {op} :c"
+                params['c'] = after[1]
+            rows += fetch_all(f"{select} {where(f'{sort} IS NULL', keyset)} ORDER BY code {order} LIMIT :limit", params)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        value = last[ENTRY_COLUMNS.index(sort)]
+        if sort == 'date' and value is not None:
+            value = db_date(value)
+        next_cursor = encode_cursor(value, last[0])
+    return rows, next_cursor
+
+def parse_list_args(args):
+    sort = args.get('sort', LIST_DEFAULT_SORT)
+    if sort not in LIST_SORT_COLUMNS:
+        sort = LIST_DEFAULT_SORT
+    direction = args.get('dir', LIST_DEFAULT_DIR)
+    if direction not in ('asc', 'desc'):
+        direction = LIST_DEFAULT_DIR
+    try:
+        per_page = int(args.get('per_page', LIST_DEFAULT_PER_PAGE))
+    except ValueError:
+        per_page = LIST_DEFAULT_PER_PAGE
+    per_page = max(1, min(per_page, LIST_MAX_PER_PAGE))
+    return sort, direction, per_page
+
+# นำเข้าข้อมูลจากไฟล์ Excel/CSV (คอลัมน์เดียวกับไฟล์ export)
+# ตรวจทุกแถวก่อน จองเลขลำดับทีละรหัสหลัก แล้ว INSERT ทั้งหมดใน transaction เดียว
+# (SQLite ใช้ executemany, PostgreSQL ใช้ COPY เมื่อ driver รองรับ)
+IMPORT_COLUMNS = {
+    'วันที่': 'date',
+    'รหัสตัวอย่าง': 'base_code',
+    'น้ำหนักขาเข้า': 'weight_in',
+    'น้ำหนักขาออก': 'weight_out',
+    'คุณภาพ': 'quality',
+}
+app.config['MAX_CONTENT_LENGTH'] = _env_int('MAX_UPLOAD_MB', 20) * 1024 * 1024
+
+def read_upload_rows(upload):
+    filename = (upload.filename or '').lower()
+    if filename.endswith('.csv'):
+        rows = csv.reader(io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline=''))
+    elif filename.endswith('.xlsx'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(upload.stream, read_only=True, data_only=True)
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+    else:
+        raise ValueError('รองรับเฉพาะไฟล์ .xlsx และ .csv')
+    header = next(rows, None) or []
+    columns = {}
+    for idx, name in enumerate(header):
+        field = IMPORT_COLUMNS.get(str(name).strip()) if name is not None else None
+        if field:
+            columns[field] = idx
+    if 'base_code' not in columns:
+        raise ValueError('ไม่พบคอลัมน์ รหัสตัวอย่าง ในแถวแรกของไฟล์')
+    for row_number, values in enumerate(rows, start=2):
+        record = {field: values[idx] if idx < len(values) else None for field, idx in columns.items()}
+        yield row_number, record
+
+def parse_import_record(record):
+    # คืนค่า (base_code, date, weight_in, weight_out, quality) หรือ raise ValueError พร้อมข้อความ
+    base_code = record.get('base_code')
+    if isinstance(base_code, float) and base_code.is_integer():
+        base_code = int(base_code)
+    base_code = str(base_code).strip() if base_code is not None else ''
+    if not base_code:
+        raise ValueError('ไม่ได้ระบุรหัสตัวอย่าง')
+    # ระบบเติมเลขลำดับให้เอง รหัสเต็มจากไฟล์ export (เช่น X-1) จึงต้องไม่ถูกนำเข้าซ้ำเป็น X-1-1
+    base, num = split_code(base_code)
+    if base is not None:
+        raise ValueError(f'รหัส {base_code} มีเลขลำดับอยู่แล้ว ไฟล์นำเข้าต้องใช้รหัสหลัก (เช่น {base})')
+    date = db_date(record.get('date'))
+    numbers = []
+    for field, label in (('weight_in', 'น้ำหนักขาเข้า'), ('weight_out', 'น้ำหนักขาออก'), ('quality', 'คุณภาพ')):
+        value = record.get(field)
+        if value is None or (isinstance(value, str) and not value.strip()):
+            numbers.append(None)
+            continue
+        try:
+            numbers.append(float(value))
+        except (TypeError, ValueError):
+            raise ValueError(f'{label} ไม่ใช่ตัวเลข: {value}')
+    return (base_code, date, *numbers)
+
+def assign_codes(run_suffix, records):
+    # จองเลขลำดับครั้งเดียวต่อรหัสหลัก แล้วแจกให้แต่ละแถวตามลำดับในไฟล์
+    counts = {}
+    for record in records:
+        counts[record[0]] = counts.get(record[0], 0) + 1
+    next_nums = {}
+    for base, n in counts.items():
+        next_nums[base] = run_suffix(base, n) - n + 1
+    rows = []
+    for base, date, weight_in, weight_out, quality in records:
+        rows.append((f"{base}-{next_nums[base]}", date, weight_in, weight_out, quality))
+        next_nums[base] += 1
+    return rows
+
+def insert_entries_bulk(records):
+    db = get_db()
+    if 'DATABASE_URL' in os.environ:
+        with db() as session:
+            session.execute(text(BUMP_VERSION_SQL), bump_version_params())
+            version = session.execute(text(VERSION_SQL)).scalar_one()
+            rows = assign_codes(
+                lambda base, n: session.execute(text(NEXT_SUFFIX_SQL), {'base': base, 'n': n}).scalar_one(), records)
+            raw_conn = session.connection().connection.dbapi_connection
+            raw_cursor = raw_conn.cursor()
+            if hasattr(raw_cursor, 'copy_expert'):
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                buffer.seek(0)
+                raw_cursor.copy_expert("COPY entries (code, date, weight_in, weight_out, quality) FROM STDIN WITH (FORMAT csv)", buffer)
+            else:
+                session.execute(text("INSERT INTO entries (code, date, weight_in, weight_out, quality) VALUES (:code, :date, :wi, :wo, :q)"),
+                                [{'code': r[0], 'date': r[1], 'wi': r[2], 'wo': r[3], 'q': r[4]} for r in rows])
+            session.execute(text(log_changes_sql('insert')), log_changes_params(version, [r[0] for r in rows]))
+            session.commit()
+    else:
+        try:
+            cursor = db.cursor()
+            cursor.execute(BUMP_VERSION_SQL, bump_version_params())
+            version = cursor.execute(VERSION_SQL).fetchone()[0]
+            rows = assign_codes(
+                lambda base, n: cursor.execute(NEXT_SUFFIX_SQL, {'base': base, 'n': n}).fetchone()[0], records)
+            cursor.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?)", rows)
+            cursor.execute(log_changes_sql('insert'), log_changes_params(version, [r[0] for r in rows]))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    list_cache.record_write(version, [(row[0], row[1], row[4]) for row in rows])
+    remember_write(version)
+    return [row[0] for row in rows]
+
+@app.route('/import', methods=['POST'])
+@login_required
+def import_entries():
+    upload = request.files.get('file')
+    report = {'imported': 0, 'failed': 0, 'rows': []}
+    if not upload or not upload.filename:
+        flash('กรุณาเลือกไฟล์ที่จะนำเข้า', 'danger')
+        return redirect(url_for('index'))
+    try:
+        records, row_numbers = [], []
+        for row_number, record in read_upload_rows(upload):
+            if all(value is None or (isinstance(value, str) and not value.strip()) for value in record.values()):
+                continue
+            try:
+                records.append(parse_import_record(record))
+                row_numbers.append(row_number)
+            except ValueError as e:
+                report['rows'].append({'row': row_number, 'code': None, 'ok': False, 'message': str(e)})
+        codes = insert_entries_bulk(records) if records else []
+        report['rows'].extend(
+            {'row': row_number, 'code': code, 'ok': True, 'message': 'นำเข้าแล้ว'}
+            for row_number, code in zip(row_numbers, codes)
+        )
+        report['rows'].sort(key=lambda item: item['row'])
+        report['imported'] = len(codes)
+        report['failed'] = len(report['rows']) - len(codes)
+    except Exception as e:
+        flash(f'เกิดข้อผิดพลาดในการนำเข้า: {e}', 'danger')
+        report = None
+    if request.args.get('format') == 'json':
+        if report is None:
+            return jsonify({'error': get_flashed_messages()[-1]}), 400
+        return jsonify(report)
+    if report is not None:
+        flash(f"นำเข้าข้อมูล {report['imported']} แถวเรียบร้อยแล้ว", 'success' if not report['failed'] else 'danger')
+    today_th = datetime.now().strftime('%d/%m/%Y')
+    prefill = {'base_code': '', 'date': today_th, 'weight_in': '', 'weight_out': '', 'quality': ''}
+    return render_form(prefill, report)
+
+# cache ของตาราง /list ที่ render แล้ว แยกตาม sort / ทิศทาง / จำนวนต่อหน้า / cursor / ตัวกรอง
+# แต่ละ entry จำ data_version ตอนอ่าน ส่วนการเขียนทุกครั้งบันทึก (version, แถวที่เปลี่ยน) ลง write log
+# ตอนอ่านถ้า version ขยับ จะทิ้งเฉพาะหน้าที่แถวที่เปลี่ยนตกอยู่ในช่วงของหน้านั้น (ตรงตัวกรอง และอยู่ระหว่าง cursor กับแถวสุดท้าย)
+# ถ้า log ขาดช่วง (เช่น worker อื่นเขียนโดยไม่ได้ใช้ cache ร่วมกัน) ถือว่าหน้านั้นใช้ไม่ได้
+# ค่าเริ่มต้นเก็บในหน่วยความจำของ process, ตั้ง LIST_CACHE_DIR เพื่อให้ทุก worker บนเครื่องเดียวกันใช้ไฟล์ร่วมกัน
+LIST_CACHE_LOG_SIZE = 1024
+# import ขนาดใหญ่ไม่เก็บรายแถวใน log แต่นับว่ากระทบทุกหน้า
+LIST_CACHE_LOG_ROWS = 500
+
+def list_sort_key(sort, code, date, quality):
+    value = None if sort == 'code' else date if sort == 'date' else quality
+    if sort == 'date' and value is not None:
+        value = db_date(value)
+    elif isinstance(value, Decimal):
+        value = float(value)
+    return [value, code]
+
+def list_sorts_before(a, b, direction):
+    # ลำดับเดียวกับ fetch_entries_page: ค่า NULL อยู่ท้ายเสมอ แล้วค่อยเรียงด้วย code
+    if (a[0] is None) != (b[0] is None):
+        return b[0] is None
+    left, right = (a[1], b[1]) if a[0] is None else (tuple(a), tuple(b))
+    return left < right if direction == 'asc' else left > right
+
+def list_page_affected(scope, row):
+    code, date, quality = row
+    filters = scope['filters']
+    if filters['from'] and (date is None or date < filters['from']):
+        return False
+    if filters['to'] and (date is None or date > filters['to']):
+        return False
+    query = filters['q'].lower()
+    if query and not (query in code.lower() if filters['match'] == 'contains' else code.lower().startswith(query)):
+        return False
+    key = list_sort_key(scope['sort'], code, date, quality)
+    # PostgreSQL เรียง code ตาม collation ของฐานข้อมูล (เช่น en_US) ซึ่ง Python เทียบให้ตรงไม่ได้
+    # ถ้าตัดสินกันที่ code ให้ถือว่าอยู่ในช่วงของหน้าไว้ก่อน (ทิ้ง cache เกินดีกว่าค้าง)
+    def decided_by_code(bound):
+        return 'DATABASE_URL' in os.environ and (bound[0] is None) == (key[0] is None) and bound[0] == key[0]
+    if scope['after'] and not decided_by_code(scope['after']) and not list_sorts_before(scope['after'], key, scope['direction']):
+        return False
+    # หน้าเต็ม: แถวที่เรียงหลังแถวสุดท้ายอยู่หน้าถัดไป ไม่กระทบหน้านี้
+    if scope['last'] and not decided_by_code(scope['last']) and list_sorts_before(scope['last'], key, scope['direction']):
+        return False
+    return True
+
+def list_scope_filters(args, conditions, filter_params):
+    # ตัวกรองของหน้าในรูปที่ list_page_affected ใช้ (ตัวกรองที่ไม่ถูกต้องถูกทิ้งไปแล้วใน entry_filters)
+    return {'from': filter_params.get('date_from'), 'to': filter_params.get('date_to'),
+            'q': (args.get('q') or '').strip()[:SEARCH_MAX_LENGTH] if conditions else '',
+            'match': args.get('match') or 'prefix'}
+
+class ListCache:
+    def __init__(self, max_bytes, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.log = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def key(self, scope, per_page):
+        raw = json.dumps([ETAG_SALT, scope['sort'], scope['direction'], per_page, scope['after'], scope['filters']],
+                         sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write_json(self, name, value):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        with os.fdopen(fd, 'w', encoding='utf-8') as output:
+            json.dump(value, output, ensure_ascii=False)
+        os.replace(tmp_path, self._path(name))
+
+    def _read_json(self, name):
+        try:
+            with open(self._path(name), encoding='utf-8') as fileobj:
+                return json.load(fileobj)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _load(self, key):
+        if self.directory:
+            entry = self._read_json(f'page-{key}.json')
+            if entry is not None:
+                os.utime(self._path(f'page-{key}.json'))
+            return entry
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            self.entries.move_to_end(key)
+            return item[1]
+
+    def _store(self, key, entry):
+        if self.directory:
+            self._write_json(f'page-{key}.json', entry)
+            self.evict(f'page-{key}.json')
+            return
+        size = sys.getsizeof(entry['html']) + 512
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[0]
+            self.entries[key] = (size, entry)
+            self.size += size
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, (dropped, _) = self.entries.popitem(last=False)
+                self.size -= dropped
+                self.evictions += 1
+
+    def _drop(self, key):
+        if self.directory:
+            try:
+                os.unlink(self._path(f'page-{key}.json'))
+            except FileNotFoundError:
+                pass
+            return
+        with self.lock:
+            item = self.entries.pop(key, None)
+            if item is not None:
+                self.size -= item[0]
+
+    def _log_get(self, version):
+        if self.directory:
+            return self._read_json(f'log-{version}.json')
+        with self.lock:
+            return self.log.get(version)
+
+    def get(self, key, version):
+        if not self.enabled:
+            return None
+        entry = self._load(key)
+        valid = entry is not None and version - entry['version'] <= LIST_CACHE_LOG_SIZE
+        if valid:
+            for changed in range(entry['version'] + 1, version + 1):
+                record = self._log_get(changed)
+                if record is None or record['rows'] is None or any(
+                        list_page_affected(entry['scope'], row) for row in record['rows']):
+                    valid = False
+                    break
+        with self.lock:
+            if entry is not None and not valid:
+                self.invalidations += 1
+            if valid:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is not None and not valid:
+            self._drop(key)
+            return None
+        if valid and entry['version'] < version:
+            # ผ่านการตรวจแล้ว เลื่อน version ไว้ ครั้งหน้าจะได้ไม่ต้องไล่ log ช่วงเดิมซ้ำ
+            entry['version'] = version
+            if self.directory:
+                self._store(key, entry)
+        return entry if valid else None
+
+    def put(self, key, version, scope, html, count):
+        if self.enabled:
+            self._store(key, {'version': version, 'scope': scope, 'html': str(html), 'count': count})
+
+    def record_write(self, version, rows):
+        # rows: [(code, date, quality), ...] ของแถวที่เพิ่มหรือลบใน version นี้ (หลัง commit)
+        if not self.enabled:
+            return
+        rows = [[code, db_date(date) if date is not None else None, float(quality) if quality is not None else None]
+                for code, date, quality in rows] if len(rows) <= LIST_CACHE_LOG_ROWS else None
+        if self.directory:
+            self._write_json(f'log-{version}.json', {'rows': rows})
+            try:
+                os.unlink(self._path(f'log-{version - LIST_CACHE_LOG_SIZE}.json'))
+            except FileNotFoundError:
+                pass
+            return
+        with self.lock:
+            self.log[version] = {'rows': rows}
+            while len(self.log) > LIST_CACHE_LOG_SIZE:
+                self.log.popitem(last=False)
+
+    def evict(self, keep):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.startswith('page-') or name.endswith('.part'):
+                continue
+            try:
+                stat = os.stat(self._path(name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            try:
+                os.unlink(self._path(name))
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self.lock:
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            stats = {'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations,
+                     'evictions': self.evictions}
+            if not self.directory:
+                stats.update(entries=len(self.entries), bytes=self.size, max_bytes=self.max_bytes)
+            return stats
+
+list_cache = ListCache(_env_int('LIST_CACHE_MAX_MB', 32) * 1024 * 1024, os.environ.get('LIST_CACHE_DIR') or None)
 
 # หน้ารายการ (protected)
 @app.route('/list')
 @login_required
 def list_entries():
-    db = get_db()
+    sort, direction, per_page = parse_list_args(request.args)
     try:
-        if 'DATABASE_URL' in os.environ:
-            with db() as session:
-                result = session.execute(text("SELECT * FROM entries"))
-                df = pd.DataFrame(result.fetchall(), columns=['code', 'date', 'weight_in', 'weight_out', 'quality'])
-        else:
-            df = pd.read_sql_query("SELECT * FROM entries", db)
-            db.close()
-
-        if not df.empty:
-            df['สถานะ'] = df['quality'].apply(get_status)
-            df['แก้ไข'] = df['code'].apply(lambda x: f'<a href="/?code={x}" class="btn btn-sm btn-warning"><i class="bi bi-pencil"></i></a>')
-            df['ลบ'] = df['code'].apply(lambda x: f'<button onclick="confirmDelete(\'{x}\')" class="btn btn-sm btn-danger"><i class="bi bi-trash"></i></button>')
-            df = df.rename(columns={
-                'date': 'วันที่',
-                'code': 'รหัสตัวอย่าง',
-                'weight_in': 'น้ำหนักขาเข้า',
-                'weight_out': 'น้ำหนักขาออก',
-                'quality': 'คุณภาพ'
-            })
-            df = df[['วันที่', 'รหัสตัวอย่าง', 'น้ำหนักขาเข้า', 'น้ำหนักขาออก', 'คุณภาพ', 'สถานะ', 'แก้ไข', 'ลบ']]
+        use_read_replica()
+        # อ่าน version ก่อน query เสมอ ถ้ามีการแก้ระหว่างนั้น ETag จะเก่ากว่าข้อมูล (poll ครั้งถัดไปโหลดใหม่) ไม่ใช่กลับกัน
+        # seq ของ change log อ่านก่อน version: หน้าที่ได้มีการเปลี่ยนแปลงถึง seq นี้แล้วเสมอ (live update เริ่มต่อจากตรงนี้)
+        change_seq = latest_change_seq()
+        version, updated_at = get_data_version()
+        etag, last_modified = version_validators(version, updated_at, 'list', current_user.get_id(),
+                                                 request.query_string.decode('utf-8', 'replace'))
+        cached = not_modified(etag, last_modified)
+        if cached is not None:
+            return cached
+        try:
+            conditions, filter_params = entry_filters(request.args)
+        except ValueError as e:
+            flash(str(e), 'danger')
+            conditions, filter_params = [], {}
+        after = None
+        if request.args.get('cursor'):
+            try:
+                after = decode_cursor(request.args['cursor'], sort)
+            except (ValueError, TypeError):
+                flash('ลิงก์หน้าไม่ถูกต้อง แสดงหน้าแรกแทน', 'danger')
+        filter_args = {key: request.args[key] for key in ('from', 'to', 'q', 'match') if request.args.get(key)}
+        page_args = {'sort': sort, 'dir': direction, 'per_page': per_page, **filter_args}
+        scroll_view = request.args.get('view') == 'scroll'
+        if scroll_view:
+            # มุมมองเลื่อนต่อเนื่อง: ส่งแค่โครงหน้า แถวโหลดจาก /list/data และสร้างเฉพาะส่วนที่มองเห็นใน browser
+            page = {'html': render_template('_list_scroll.html', sort=sort, direction=direction,
+                                            data_url=url_for('list_data', sort=sort, dir=direction, **filter_args)),
+                    'count': 0}
         else:
-            df = pd.DataFrame(columns=['วันที่', 'รหัสตัวอย่าง', 'น้ำหนักขาเข้า', 'น้ำหนักขาออก', 'คุณภาพ', 'สถานะ', 'แก้ไข', 'ลบ'])
-
-        def center(val):
-            return f'<div class="text-center">{val}</div>'
-        formatters = {col: center for col in df.columns}
-
-        table_html = df.to_html(escape=False, index=False, classes="table table-striped table-hover", formatters=formatters, border=0)
-
-        list_content = f"""
-        <div class="card p-4">
-            <div class="d-flex justify-content-between align-items-center mb-4">
-                <h2 class="text-success"><i class="bi bi-list-ul"></i> รายการทั้งหมด ({len(df)} รายการ)</h2>
-                <div>
-                    <a href="/export" class="btn btn-success">
-                        <i class="bi bi-file-excel"></i> Export Excel
-                    </a>
-                    <a href="/" class="btn btn-outline-primary">
-                        <i class="bi bi-plus-circle"></i> เพิ่มข้อมูล
-                    </a>
-                </div>
-            </div>
-            {table_html if not df.empty else '<div class="alert alert-info">ยังไม่มีข้อมูล</div>'}
-        </div>
-        """
-
-        # Modal ลบ
-        modal = """
-        <div class="modal fade" id="deleteModal" tabindex="-1">
-          <div class="modal-dialog">
-            <div class="modal-content">
-              <div class="modal-header bg-danger text-white">
-                <h5 class="modal-title"><i class="bi bi-exclamation-triangle"></i> ยืนยันการลบ</h5>
-                <button type="button" class="btn-close btn-close-white" data-bs-dismiss="modal"></button>
-              </div>
-              <div class="modal-body">
-                <p>คุณแน่ใจหรือไม่ว่าต้องการลบข้อมูลรหัส <strong id="deleteCode"></strong>?</p>
-                <p class="text-danger"><small>การกระทำนี้ไม่สามารถกู้คืนได้</small></p>
-              </div>
-              <div class="modal-footer">
-                <button type="button" class="btn btn-secondary" data-bs-dismiss="modal">ยกเลิก</button>
-                <form method="post" action="/delete" style="display:inline;">
-                  <input type="hidden" name="code" id="deleteCodeInput">
-                  <button type="submit" class="btn btn-danger">ลบข้อมูล</button>
-                </form>
-              </div>
-            </div>
-          </div>
-        </div>
-        <script>
-            function confirmDelete(code) {
-                document.getElementById('deleteCode').textContent = code;
-                document.getElementById('deleteCodeInput').value = code;
-                new bootstrap.Modal(document.getElementById('deleteModal')).show();
-            }
-        </script>
-        """
-
-        return f"""
-        <!DOCTYPE html>
-        <html lang="th">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1">
-            <title>รายการข้อมูล</title>
-            <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet">
-            <link href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.0/font/bootstrap-icons.css" rel="stylesheet">
-            <style>
-                body {{ background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%); min-height: 100vh; }}
-                .container {{ max-width: 1100px; }}
-                .card {{ box-shadow: 0 4px 12px rgba(0,0,0,0.1); border: none; }}
-                .table th {{ background-color: #0d6efd; color: white; text-align: center; }}
-                .table td {{ vertical-align: middle; text-align: center; }}
-                .btn-sm {{ font-size: 0.8rem; }}
-            </style>
-        </head>
-        <body>
-        <nav class="navbar navbar-expand-lg navbar-dark bg-primary">
-            <div class="container">
-                <a class="navbar-brand" href="/"><i class="bi bi-flask"></i> APAC Biosciences</a>
-                <div class="navbar-nav ms-auto">
-                    <a class="nav-link" href="/">เพิ่มข้อมูล</a>
-                    <a class="nav-link" href="/logout">ออกจากระบบ</a>
-                </div>
-            </div>
-        </nav>
-        <div class="container py-5">
-            {list_content}
-            {modal}
-        </div>
-        <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js"></script>
-        </body>
-        </html>
-        """
+            page = None
+        scope = {
+            'sort': sort, 'direction': direction,
+            'after': list_sort_key(sort, after[1], after[0], after[0]) if after else None, 'last': None,
+            'filters': list_scope_filters(request.args, conditions, filter_params),
+        }
+        cache_key = list_cache.key(scope, per_page)
+        if page is None:
+            page = list_cache.get(cache_key, version)
+        if page is None:
+            rows, next_cursor = fetch_entries_page(sort, direction, after, per_page, conditions, filter_params)
+            badges = status_badges([row[4] for row in rows])
+            entries = [
+                {'code': code, 'date': format_entry_date(date), 'date_iso': db_date(date), 'weight_in': weight_in,
+                 'weight_out': weight_out, 'quality': quality, 'status': badge}
+                for (code, date, weight_in, weight_out, quality), badge in zip(rows, badges)
+            ]
+            table = render_template('_list_table.html', rows=entries, page_args=page_args, sort=sort, direction=direction,
+                                    first_page=after is None, next_cursor=next_cursor)
+            if next_cursor:
+                last = rows[-1]
+                scope['last'] = list_sort_key(sort, last[0], last[1], last[4])
+            list_cache.put(cache_key, version, scope, table, len(rows))
+            page = {'html': table, 'count': len(rows)}
+        # หน้าที่มี flash ห้ามให้ browser ใช้ซ้ำ (ไม่ส่ง ETag)
+        cacheable = '_flashes' not in session
+        response = app.make_response(render_template(
+            'list.html',
+            table=Markup(page['html']),
+            row_count=page['count'],
+            sort=sort,
+            direction=direction,
+            per_page=per_page,
+            max_per_page=LIST_MAX_PER_PAGE,
+            sort_labels={'date': 'วันที่', 'code': 'รหัสตัวอย่าง', 'quality': 'คุณภาพ'},
+            search_modes=SEARCH_MODES,
+            filter_args=filter_args,
+            change_seq=change_seq,
+            scroll_view=scroll_view,
+            quality_edges=QUALITY_EDGES,
+            status_badges=STATUS_BADGES,
+        ))
+        return set_validators(response, etag, last_modified) if cacheable else response
     except Exception as e:
         flash(f'เกิดข้อผิดพลาดในการโหลดรายการ: {e}', 'danger')
         return redirect(url_for('index'))
 
+# ข้อมูลรายการแบบ columnar (หนึ่ง array ต่อคอลัมน์ ไม่มี HTML) สำหรับมุมมองเลื่อนต่อเนื่องของ /list
+# ใช้ตัวกรอง การเรียง และ cursor ชุดเดียวกับ /list, badge และปุ่มสร้างฝั่ง browser จากค่าคุณภาพ
+LIST_DATA_DEFAULT_LIMIT = 500
+LIST_DATA_MAX_LIMIT = 5000
+
+@app.route('/list/data')
+@login_required
+def list_data():
+    sort, direction, _ = parse_list_args(request.args)
+    use_read_replica()
+    try:
+        limit = min(max(int(request.args.get('limit', LIST_DATA_DEFAULT_LIMIT)), 1), LIST_DATA_MAX_LIMIT)
+        conditions, filter_params = entry_filters(request.args)
+        after = decode_cursor(request.args['cursor'], sort) if request.args.get('cursor') else None
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    version, updated_at = get_data_version()
+    etag, last_modified = version_validators(version, updated_at, 'list-data', current_user.get_id(),
+                                             request.query_string.decode('utf-8', 'replace'))
+    cached = not_modified(etag, last_modified)
+    if cached is not None:
+        return cached
+    rows, next_cursor = fetch_entries_page(sort, direction, after, limit, conditions, filter_params)
+    columns = list(zip(*rows)) or [()] * len(ENTRY_COLUMNS)
+    data = {name: [json_number(value) for value in values] for name, values in zip(ENTRY_COLUMNS, columns)}
+    data['date'] = [db_date(value) for value in data['date']]
+    data['next_cursor'] = next_cursor
+    return set_validators(jsonify(data), etag, last_modified)
+
 # ลบ (protected)
+def in_code_set(base_code, code):
+    # รหัสในชุดเดียวกันคือ "<รหัสหลัก>-<เลข>" (รหัสหลักเองมี '-' ได้)
+    prefix, _, suffix = code.rpartition('-')
+    return prefix == base_code and suffix.isdigit()
+
+def delete_entries(codes, base_code=None):
+    # ลบหลายรหัส และ/หรือทุกรหัสในชุดของ base_code ใน transaction เดียว คืนแถว (code, date, quality) ที่ลบไป
+    codes = list(dict.fromkeys(code for code in codes if code))
+    wanted = set(codes)
+    postgres = 'DATABASE_URL' in os.environ
+    condition, params = in_codes_sql(), {'codes': in_codes_param(codes)}
+    if base_code:
+        # ใช้ index เดียวกับการค้นหาแบบขึ้นต้นด้วย แล้วค่อยกรองรูปแบบ "<base>-<เลข>" ให้ตรงเป๊ะใน Python
+        if postgres:
+            condition += " OR lower(code) LIKE :base_like"
+            params['base_like'] = f"{like_escape(base_code.lower())}-%"
+        else:
+            condition += " OR code LIKE :base_like ESCAPE '\\'"
+            params['base_like'] = f"{like_escape(base_code)}-%"
+    select_sql = f"SELECT code, date, quality FROM entries WHERE {condition}"
+    keep = lambda code: code in wanted or (base_code and in_code_set(base_code, code))
+    db = get_db()
+    if postgres:
+        with db() as session:
+            session.execute(text(BUMP_VERSION_SQL), bump_version_params())
+            version = session.execute(text(VERSION_SQL)).scalar_one()
+            # อ่านแถวเดิมก่อนลบ เพื่อรู้ว่าต้องทิ้ง cache หน้าไหน (writer ถูก serialize ด้วย row lock ของ data_version แล้ว)
+            deleted = [tuple(row) for row in session.execute(text(select_sql), params) if keep(row[0])]
+            if deleted:
+                changes = log_changes_params(version, [row[0] for row in deleted])
+                session.execute(text(log_changes_sql('delete')), changes)
+                session.execute(text(f"DELETE FROM entries WHERE {in_codes_sql()}"), changes)
+                session.commit()
+            else:
+                session.rollback()
+    else:
+        try:
+            cursor = db.cursor()
+            cursor.execute(BUMP_VERSION_SQL, bump_version_params())
+            version = cursor.execute(VERSION_SQL).fetchone()[0]
+            deleted = [row for row in cursor.execute(select_sql, params).fetchall() if keep(row[0])]
+            if deleted:
+                changes = log_changes_params(version, [row[0] for row in deleted])
+                cursor.execute(log_changes_sql('delete'), changes)
+                cursor.execute(f"DELETE FROM entries WHERE {in_codes_sql()}", changes)
+                db.commit()
+            else:
+                db.rollback()
+        except Exception:
+            db.rollback()
+            raise
+    if deleted:
+        list_cache.record_write(version, deleted)
+        remember_write(version)
+    return deleted
+
 @app.route('/delete', methods=['POST'])
 @login_required
 def delete_entry():
-    code = request.form.get('code')
-    if code:
-        db = get_db()
+    # code ส่งมาได้หลายค่า (เลือกหลายแถว) และ/หรือ base_code เพื่อลบทั้งชุด
+    codes = [code for code in request.form.getlist('code') if code]
+    base_code = (request.form.get('base_code') or '').strip()
+    deleted = None
+    if codes or base_code:
         try:
-            if 'DATABASE_URL' in os.environ:
-                with db() as session:
-                    session.execute(text("DELETE FROM entries WHERE code = :code"), {'code': code})
-                    session.commit()
-                flash(f"ลบข้อมูลรหัส {code} เรียบร้อยแล้ว!", "success")
-            else:
-                cursor = db.cursor()
-                cursor.execute("DELETE FROM entries WHERE code=?", (code,))
-                db.commit()
-                db.close()
-                flash(f"ลบข้อมูลรหัส {code} เรียบร้อยแล้ว!", "success")
+            deleted = [row[0] for row in delete_entries(codes, base_code)]
         except Exception as e:
             flash(f'เกิดข้อผิดพลาดในการลบ: {e}', 'danger')
-    return redirect(url_for('list_entries'))
+    missing = sorted(set(codes) - set(deleted or ()))
+    if request.args.get('format') == 'json':
+        if deleted is None:
+            return jsonify({'error': get_flashed_messages()[-1] if codes or base_code else 'กรุณาระบุรหัสที่จะลบ'}), 400
+        return jsonify({'deleted': deleted, 'missing': missing})
+    if deleted is not None:
+        if not deleted:
+            flash('ไม่พบข้อมูลที่จะลบ', 'danger')
+        elif len(deleted) == 1 and not missing:
+            flash(f"ลบข้อมูลรหัส {deleted[0]} เรียบร้อยแล้ว!", "success")
+        else:
+            flash(f"ลบข้อมูล {len(deleted)} รายการเรียบร้อยแล้ว" + (f" (ไม่พบ {len(missing)} รหัส)" if missing else ''), 'success')
+    # กลับไปหน้ารายการเดิม (ตัวกรอง / การเรียง / หน้า) ที่กดลบมา
+    return redirect(url_for('list_entries', **{key: value for key, value in request.args.items() if key != 'format'}))
 
-# Export Excel (protected)
-@app.route('/export')
+# Change feed สำหรับระบบปลายทาง (เช่น LIMS mirror): ดึงเฉพาะการเพิ่ม/ลบหลัง seq ที่เคยได้ ครั้งละไม่เกิน limit แถว
+# ใช้ primary key ของ entry_changes เป็น range scan ค่าใช้จ่ายจึงขึ้นกับจำนวนการเปลี่ยนแปลง ไม่ใช่ขนาดตาราง
+CHANGES_DEFAULT_LIMIT = 500
+CHANGES_MAX_LIMIT = 5000
+
+def json_number(value):
+    return float(value) if isinstance(value, Decimal) else value
+
+@app.route('/changes')
 @login_required
-def export():
-    db = get_db()
+def changes():
     try:
+        after = max(int(request.args.get('after', 0)), 0)
+        limit = min(max(int(request.args.get('limit', CHANGES_DEFAULT_LIMIT)), 1), CHANGES_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'after และ limit ต้องเป็นจำนวนเต็ม'}), 400
+    rows = fetch_all("SELECT seq, op, code, date, weight_in, weight_out, quality, version, changed_at FROM entry_changes "
+                     "WHERE seq > :after ORDER BY seq LIMIT :limit", {'after': after, 'limit': limit + 1})
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({
+        'changes': [
+            {'seq': seq, 'op': op, 'code': code, 'date': db_date(date), 'weight_in': json_number(weight_in),
+             'weight_out': json_number(weight_out), 'quality': json_number(quality), 'version': version,
+             'changed_at': changed_at}
+            for seq, op, code, date, weight_in, weight_out, quality, version, changed_at in rows
+        ],
+        'next': rows[-1][0] if rows else after,
+        'has_more': has_more,
+    })
+
+# Live update ของหน้า /list ผ่าน Server-Sent Events
+# แต่ละ worker มี thread เดียวที่ poll entry_changes (range scan บน seq) เฉพาะช่วงที่มีหน้าจอเปิดอยู่
+# แล้วกระจายให้ทุก stream จาก buffer ในหน่วยความจำ จำนวนหน้าจอจึงไม่เพิ่มจำนวน query
+# แต่ละ stream ถือ thread ของ gunicorn (gthread) หนึ่งตัวที่เกือบตลอดเวลารอ condition อยู่ จึงจำกัดจำนวนต่อ worker
+# ไว้ที่ 1/8 ของ WEB_THREADS (ค่าเดียวกับที่ Procfile/render.yaml ส่งให้ gunicorn --threads) ให้ thread ส่วนใหญ่รับ request ปกติเสมอ
+WEB_THREADS = _env_int('WEB_THREADS', 64)
+LIST_EVENTS_POLL_SECONDS = _env_int('LIST_EVENTS_POLL_MS', 1000) / 1000
+LIST_EVENTS_MAX_CLIENTS = _env_int('LIST_EVENTS_MAX_CLIENTS', max(1, WEB_THREADS // 8))
+LIST_EVENTS_BUFFER = 1000
+LIST_EVENTS_BACKLOG = 500
+LIST_EVENTS_HEARTBEAT = 15
+# ปิด stream เป็นระยะ browser ต่อใหม่เองด้วย Last-Event-ID (กระจายหน้าจอไปยัง worker อื่นได้)
+LIST_EVENTS_MAX_AGE = _env_int('LIST_EVENTS_MAX_AGE', 600)
+LIST_EVENTS_RETRY_MS = 3000
+
+LATEST_CHANGE_SQL = "SELECT COALESCE(MAX(seq), 0) FROM entry_changes"
+CHANGES_AFTER_SQL = ("SELECT seq, op, code, date, weight_in, weight_out, quality FROM entry_changes "
+                     "WHERE seq > :after ORDER BY seq LIMIT :limit")
+
+def latest_change_seq():
+    return int(fetch_all(LATEST_CHANGE_SQL)[0][0])
+
+class ChangeReader:
+    # connection ของตัวเองที่ถือไว้ตลอดอายุของ thread poll หรือ stream (ไม่ต้องเปิด app context ทุกรอบ)
+    # PostgreSQL: ยืม connection จาก pool และจบ transaction ทุก query ไม่ให้ค้าง idle in transaction
+    def __init__(self):
         if 'DATABASE_URL' in os.environ:
-            with db() as session:
-                result = session.execute(text("SELECT * FROM entries"))
-                df = pd.DataFrame(result.fetchall(), columns=['code', 'date', 'weight_in', 'weight_out', 'quality'])
+            self.conn = get_engine().connect()
         else:
-            df = pd.read_sql_query("SELECT * FROM entries", db)
+            self.conn = connect_sqlite()
+
+    def fetch(self, sql, params=None):
+        if 'DATABASE_URL' in os.environ:
+            try:
+                return [tuple(row) for row in self.conn.execute(text(sql), params or {}).fetchall()]
+            finally:
+                self.conn.rollback()
+        return self.conn.execute(sql, params or {}).fetchall()
+
+    def latest(self):
+        return int(self.fetch(LATEST_CHANGE_SQL)[0][0])
+
+    def changes(self, after, limit):
+        return self.fetch(CHANGES_AFTER_SQL, {'after': after, 'limit': limit})
+
+    def close(self):
+        self.conn.close()
+
+def change_events(rows):
+    # แปลงแถวของ entry_changes เป็นข้อมูลที่หน้า /list ใช้แทรกแถวได้ทันที (ค่าแสดงผลเหมือนตอน render)
+    display = lambda value: '' if value is None else str(value)
+    badges = status_badges([row[6] for row in rows])
+    return [
+        {'seq': seq, 'op': op, 'code': code, 'date': db_date(date), 'date_display': format_entry_date(date) or '',
+         'weight_in': display(weight_in), 'weight_out': display(weight_out), 'quality': json_number(quality),
+         'quality_display': display(quality), 'status': str(badge)}
+        for (seq, op, code, date, weight_in, weight_out, quality), badge in zip(rows, badges)
+    ]
+
+class ChangeBroadcaster:
+    def __init__(self, interval, buffer_size, max_clients):
+        self.interval = interval
+        self.buffer_size = buffer_size
+        self.max_clients = max_clients
+        self.events = deque()
+        # ทุก seq ที่มากกว่า floor อยู่ใน buffer ครบ, latest คือ seq ล่าสุดที่ poll เห็น
+        self.floor = None
+        self.latest = None
+        self.clients = 0
+        self.polls = 0
+        self.thread = None
+        self.cond = threading.Condition()
+
+    def subscribe(self):
+        with self.cond:
+            if self.clients >= self.max_clients:
+                return False
+            self.clients += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='list-events', daemon=True)
+                self.thread.start()
+            return True
+
+    def unsubscribe(self):
+        with self.cond:
+            self.clients -= 1
+
+    def poll(self, reader):
+        if self.latest is None:
+            latest = reader.latest()
+            with self.cond:
+                self.floor = self.latest = latest
+                self.cond.notify_all()
+            return
+        rows = reader.changes(self.latest, self.buffer_size)
+        self.polls += 1
+        if not rows:
+            return
+        events = change_events(rows)
+        with self.cond:
+            self.events.extend((event['seq'], event) for event in events)
+            while len(self.events) > self.buffer_size:
+                self.floor = self.events.popleft()[0]
+            self.latest = events[-1]['seq']
+            self.cond.notify_all()
+
+    def run(self):
+        reader = None
+        try:
+            while True:
+                with self.cond:
+                    if self.clients <= 0:
+                        # ไม่มีหน้าจอเหลือ: หยุด poll และเริ่มจาก database ใหม่เมื่อมีคนเปิดอีกครั้ง
+                        self.thread = None
+                        self.events.clear()
+                        self.floor = self.latest = None
+                        return
+                try:
+                    if reader is None:
+                        reader = ChangeReader()
+                    self.poll(reader)
+                except Exception as e:
+                    print(f"List events poll error: {e}")
+                    # connection อาจเสียไปแล้ว (เช่น database restart) เปิดใหม่ในรอบถัดไป
+                    if reader is not None:
+                        try:
+                            reader.close()
+                        except Exception:
+                            pass
+                        reader = None
+                time.sleep(self.interval)
+        finally:
+            if reader is not None:
+                reader.close()
+
+    def wait(self, position, timeout):
+        # คืน events หลัง position, [] ถ้าหมดเวลา หรือ None ถ้า position เก่ากว่า buffer (ต้องอ่านจาก database เอง)
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                if self.floor is not None and position < self.floor:
+                    return None
+                if self.latest is not None and self.latest > position:
+                    return [event for seq, event in self.events if seq > position]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self.cond.wait(remaining)
+
+    def stats(self):
+        with self.cond:
+            return {'clients': self.clients, 'max_clients': self.max_clients, 'buffered': len(self.events),
+                    'polls': self.polls}
+
+change_broadcaster = ChangeBroadcaster(LIST_EVENTS_POLL_SECONDS, LIST_EVENTS_BUFFER, LIST_EVENTS_MAX_CLIENTS)
+
+@app.route('/list/events')
+@login_required
+def list_events():
+    # เริ่มต่อจาก Last-Event-ID (browser ต่อใหม่เอง) หรือ ?after= ที่หน้า /list ได้ตอน render
+    try:
+        position = int(request.headers.get('Last-Event-ID') or request.args.get('after') or -1)
+    except ValueError:
+        position = -1
+    if position < 0:
+        position = latest_change_seq()
+    try:
+        conditions, filter_params = entry_filters(request.args)
+    except ValueError:
+        conditions, filter_params = [], {}
+    scope = {'sort': 'code', 'direction': 'asc', 'after': None, 'last': None,
+             'filters': list_scope_filters(request.args, conditions, filter_params)}
+    if not change_broadcaster.subscribe():
+        return Response('มีหน้าจอเปิดรับข้อมูลสดเต็มจำนวนแล้ว', 503, {'Retry-After': '60'}, mimetype='text/plain')
+
+    def stream(position):
+        # เปิด connection เมื่อต้องอ่านย้อนหลังจาก database ครั้งแรก แล้วใช้ต่อจนจบ stream
+        reader = None
+        try:
+            yield f"retry: {LIST_EVENTS_RETRY_MS}\n\n"
+            started = time.monotonic()
+            while time.monotonic() - started < LIST_EVENTS_MAX_AGE:
+                events = change_broadcaster.wait(position, LIST_EVENTS_HEARTBEAT)
+                if events is None:
+                    if reader is None:
+                        reader = ChangeReader()
+                    rows = reader.changes(position, LIST_EVENTS_BACKLOG + 1)
+                    if len(rows) > LIST_EVENTS_BACKLOG:
+                        # ตามหลังมากเกินไป ให้หน้าโหลดใหม่ทั้งหน้าแทน
+                        yield "event: reload\ndata: {}\n\n"
+                        return
+                    events = change_events(rows)
+                if not events:
+                    # heartbeat: ตรวจว่า client ยังอยู่ และเลื่อน Last-Event-ID ผ่าน event ที่ถูกกรองทิ้ง
+                    yield f": ping\nid: {position}\n\n"
+                    continue
+                for event in events:
+                    position = event['seq']
+                    if list_page_affected(scope, (event['code'], event['date'], event['quality'])):
+                        yield f"id: {position}\nevent: {event['op']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            if reader is not None:
+                reader.close()
+
+    # คืนที่ให้ broadcaster ตอนปิด response ไม่ใช่ใน finally ของ generator ซึ่งไม่ทำงานถ้า generator ไม่เคยเริ่ม
+    # (เช่น client ตัดก่อนได้ byte แรก) และกันคืนซ้ำถ้า close ถูกเรียกมากกว่าหนึ่งครั้ง
+    released = []
+
+    def release():
+        if not released:
+            released.append(True)
+            change_broadcaster.unsubscribe()
+
+    response = Response(stream(position), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(release)
+    return response
+
+# Export Excel (protected)
+# อ่านข้อมูลจาก database ทีละ chunk แล้วเขียนด้วย openpyxl แบบ write-only ลงไฟล์ชั่วคราว
+# จากนั้นส่งไฟล์ให้ client แบบ stream ทำให้หน่วยความจำคงที่ไม่ว่าจะมีกี่แถว
+EXPORT_CHUNK_SIZE = _env_int('EXPORT_CHUNK_SIZE', 2000)
+EXPORT_SHEET_NAME = 'ข้อมูลตัวอย่าง'
+EXPORT_HEADERS = ['วันที่', 'รหัสตัวอย่าง', 'น้ำหนักขาเข้า', 'น้ำหนักขาออก', 'คุณภาพ', 'สถานะ']
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+def iter_entry_chunks(conditions=(), params=None, chunk_size=EXPORT_CHUNK_SIZE, replica=False):
+    # PostgreSQL ใช้ server-side cursor (stream_results) ส่วน SQLite ใช้ fetchmany
+    # เรียงตาม (date, code) เพื่อให้การกรองช่วงวันที่อ่านเฉพาะแถวในช่วงนั้นผ่าน index
+    # replica ต้องส่งมาจาก request (reading_replica()) เพราะ generator อาจทำงานหลัง request จบแล้ว
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    sql = f"SELECT code, date, weight_in, weight_out, quality FROM entries {where} ORDER BY date, code"
+    if 'DATABASE_URL' in os.environ:
+        with get_db(replica)() as session:
+            result = session.execute(text(sql), params or {}, execution_options={'stream_results': True, 'max_row_buffer': chunk_size})
+            for partition in result.partitions(chunk_size):
+                yield [tuple(row) for row in partition]
+    else:
+        # ใช้ connection แยกของตัวเอง: CSV ยัง stream ต่อหลัง teardown ของ request ไปแล้ว
+        db = connect_sqlite(replica)
+        try:
+            cursor = db.execute(sql, params or {})
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
             db.close()
 
-        def clean_status(q):
-            if q is None: return 'ไม่ระบุ'
-            elif q < 50: return 'ส่งไปกลุ่ม < 50%'
-            elif q < 55: return 'ส่งไปกลุ่ม 50 - 54.9%'
-            elif q < 60: return 'ส่งไปกลุ่ม 55 - 59.9%'
-            elif q < 65: return 'ส่งไปกลุ่ม 60 - 64.9%'
-            elif q < 68: return 'ส่งไปกลุ่ม 65 - 67.9%'
-            elif q < 70: return 'ส่งไปกลุ่ม 68 - 69.9%'
-            else: return 'ส่งไปกลุ่ม > 70%'
-
-        if not df.empty:
-            df['สถานะ'] = df['quality'].apply(clean_status)
-            df = df.rename(columns={
-                'date': 'วันที่', 'code': 'รหัสตัวอย่าง',
-                'weight_in': 'น้ำหนักขาเข้า', 'weight_out': 'น้ำหนักขาออก',
-                'quality': 'คุณภาพ'
-            })
-            df = df[['วันที่', 'รหัสตัวอย่าง', 'น้ำหนักขาเข้า', 'น้ำหนักขาออก', 'คุณภาพ', 'สถานะ']]
-        else:
-            df = pd.DataFrame(columns=['วันที่', 'รหัสตัวอย่าง', 'น้ำหนักขาเข้า', 'น้ำหนักขาออก', 'คุณภาพ', 'สถานะ'])
+def export_rows(chunk):
+    labels = status_labels([row[4] for row in chunk])
+    return [(format_entry_date(date), code, weight_in, weight_out, quality, label)
+            for (code, date, weight_in, weight_out, quality), label in zip(chunk, labels)]
 
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='ข้อมูลตัวอย่าง')
-            worksheet = writer.sheets['ข้อมูลตัวอย่าง']
-            for idx, col in enumerate(df.columns, 1):
-                max_len = max(df[col].astype(str).map(len).max(), len(col)) + 2
-                worksheet.column_dimensions[get_column_letter(idx)].width = min(max_len, 50)
+def write_xlsx(fileobj, chunks):
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(EXPORT_SHEET_NAME)
+    # write-only sheet ต้องกำหนดความกว้างคอลัมน์ก่อนเขียนแถวแรก จึงคำนวณจาก chunk แรกเป็นตัวอย่าง
+    sample = export_rows(next(chunks, []))
+    for idx, header in enumerate(EXPORT_HEADERS):
+        max_len = max([len(header)] + [len(str(values[idx])) for values in sample if values[idx] is not None]) + 2
+        worksheet.column_dimensions[get_column_letter(idx + 1)].width = min(max_len, 50)
+    worksheet.append(EXPORT_HEADERS)
+    for values in sample:
+        worksheet.append(values)
+    for chunk in chunks:
+        for values in export_rows(chunk):
+            worksheet.append(values)
+    workbook.save(fileobj)
 
+def iter_csv(chunks):
+    # CSV ส่งแบบ stream ทีละ chunk (ใส่ BOM ให้ Excel อ่านภาษาไทยได้ถูก)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_HEADERS)
+    for chunk in chunks:
+        writer.writerows(export_rows(chunk))
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    remaining = buffer.getvalue()
+    if remaining:
+        yield remaining.encode('utf-8')
+
+def write_parquet(fileobj, chunks):
+    # เขียน Parquet ทีละ row group (หนึ่ง chunk ต่อหนึ่ง row group)
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([
+        (EXPORT_HEADERS[0], pa.date32()),
+        (EXPORT_HEADERS[1], pa.string()),
+        (EXPORT_HEADERS[2], pa.float64()),
+        (EXPORT_HEADERS[3], pa.float64()),
+        (EXPORT_HEADERS[4], pa.float64()),
+        (EXPORT_HEADERS[5], pa.string()),
+    ])
+    with pq.ParquetWriter(fileobj, schema, compression='snappy') as writer:
+        for chunk in chunks:
+            rows = export_rows(chunk)
+            columns = [list(values) for values in zip(*rows)]
+            columns[0] = [parse_entry_date(row[1]) for row in chunk]
+            for idx in (2, 3, 4):
+                columns[idx] = [float(v) if v is not None else None for v in columns[idx]]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+EXPORT_FORMATS = {
+    'xlsx': (write_xlsx, XLSX_MIMETYPE),
+    'parquet': (write_parquet, 'application/vnd.apache.parquet'),
+    'csv': (None, 'text/csv'),
+}
+
+# cache ไฟล์ export ตาม data_version + รูปแบบ + ตัวกรอง เก็บในโฟลเดอร์ที่ทุก worker ใช้ร่วมกัน
+# จำกัดขนาดรวมด้วย EXPORT_CACHE_MAX_MB (0 = ปิด) ลบไฟล์ที่ใช้ล่าสุดนานที่สุดก่อน และลบ version เก่าทิ้งเมื่อมีไฟล์ใหม่
+class ExportCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def path_for(self, version, fmt, params):
+        if not self.enabled:
+            return None
+        digest = hashlib.sha1(f'{ETAG_SALT}|{json.dumps(params, sort_keys=True)}'.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, f'v{version}-{digest}.{fmt}')
+
+    def open(self, path):
+        # เปิดไฟล์ไว้เลย ถ้า worker อื่นลบทิ้งระหว่างส่ง file descriptor ที่เปิดอยู่ก็ยังอ่านได้
+        if path is None:
+            return None
+        try:
+            fileobj = open(path, 'rb')
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        os.utime(path)
+        with self.lock:
+            self.hits += 1
+        return fileobj
+
+    def _tempfile(self, path):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        return os.fdopen(fd, 'w+b'), tmp_path
+
+    def build(self, path, write):
+        if path is None:
+            output = tempfile.TemporaryFile()
+            try:
+                write(output)
+            except Exception:
+                output.close()
+                raise
+            output.seek(0)
+            return output
+        output, tmp_path = self._tempfile(path)
+        try:
+            write(output)
+            output.flush()
+            os.replace(tmp_path, path)
+        except Exception:
+            output.close()
+            os.unlink(tmp_path)
+            raise
+        self.evict(path)
         output.seek(0)
-        return send_file(
+        return output
+
+    def tee(self, chunks, path):
+        # เขียนสำเนาระหว่าง stream เก็บเข้า cache เฉพาะเมื่อส่งครบทั้งไฟล์
+        if path is None:
+            yield from chunks
+            return
+        output, tmp_path = self._tempfile(path)
+        complete = False
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+                yield chunk
+            output.close()
+            os.replace(tmp_path, path)
+            complete = True
+            self.evict(path)
+        finally:
+            if not complete:
+                output.close()
+                os.unlink(tmp_path)
+
+    def evict(self, keep):
+        current = os.path.basename(keep).split('-', 1)[0]
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.part'):
+                continue
+            try:
+                if name.split('-', 1)[0] != current:
+                    os.unlink(path)
+                    with self.lock:
+                        self.evictions += 1
+                    continue
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self.lock:
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+export_cache = ExportCache(
+    os.environ.get('EXPORT_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'apac-export-cache'),
+    _env_int('EXPORT_CACHE_MAX_MB', 256) * 1024 * 1024,
+)
+
+@app.route('/export')
+@login_required
+def export():
+    fmt = request.args.get('format', 'xlsx').lower()
+    if fmt not in EXPORT_FORMATS:
+        flash(f'ไม่รองรับรูปแบบไฟล์ {fmt}', 'danger')
+        return redirect(url_for('list_entries'))
+    writer, mimetype = EXPORT_FORMATS[fmt]
+    download_name = f'ข้อมูลตัวอย่าง.{fmt}'
+    try:
+        replica = use_read_replica()
+        conditions, params = entry_filters(request.args)
+        version, updated_at = get_data_version()
+        etag, last_modified = version_validators(version, updated_at, 'export', fmt, json.dumps(params, sort_keys=True))
+        cached = not_modified(etag, last_modified)
+        if cached is not None:
+            return cached
+        cache_path = export_cache.path_for(version, fmt, params)
+        output = export_cache.open(cache_path)
+        if output is None and fmt == 'csv':
+            chunks = timed_iter(iter_csv(iter_entry_chunks(conditions, params, replica=replica)), EXPORT_SECONDS, fmt)
+            response = Response(export_cache.tee(chunks, cache_path), mimetype=mimetype)
+            response.headers['Content-Disposition'] = f"attachment; filename=entries.csv; filename*=UTF-8''{quote(download_name)}"
+            return set_validators(response, etag, last_modified)
+        if output is None:
+            def write(fileobj):
+                start = time.perf_counter()
+                writer(fileobj, iter_entry_chunks(conditions, params, replica=replica))
+                EXPORT_SECONDS.observe(time.perf_counter() - start, fmt)
+            output = export_cache.build(cache_path, write)
+        response = send_file(
             output,
             as_attachment=True,
-            download_name='ข้อมูลตัวอย่าง.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            download_name=download_name,
+            mimetype=mimetype,
+            conditional=False,
+            etag=False
         )
+        if fmt == 'csv':
+            response.headers['Content-Disposition'] = f"attachment; filename=entries.csv; filename*=UTF-8''{quote(download_name)}"
+        return set_validators(response, etag, last_modified)
     except Exception as e:
         flash(f'เกิดข้อผิดพลาดในการ export: {e}', 'danger')
         return redirect(url_for('list_entries'))
 
+# Export เบื้องหลัง: สร้างไฟล์ใน thread pool ของ worker ที่รับงาน แล้วให้ client poll สถานะ/ดาวน์โหลดทีหลัง
+# สถานะงานเป็นไฟล์ JSON ในโฟลเดอร์ที่ทุก worker ใช้ร่วมกัน worker ไหนก็ตอบ poll ได้
+EXPORT_JOB_DIR = os.environ.get('EXPORT_JOB_DIR') or os.path.join(tempfile.gettempdir(), 'apac-export-jobs')
+EXPORT_JOB_WORKERS = max(1, _env_int('EXPORT_JOB_WORKERS', 2))
+EXPORT_JOB_MAX_PENDING = _env_int('EXPORT_JOB_MAX_PENDING', 8)
+EXPORT_JOB_TTL = _env_int('EXPORT_JOB_TTL', 3600)
+# process ที่มีงานค้างอยู่แตะไฟล์ heartbeat ของตัวเองทุก EXPORT_JOB_HEARTBEAT วินาทีจาก thread แยก (เดินต่อแม้ระหว่าง
+# workbook.save() ที่ไม่มีการอัปเดตสถานะ) ถ้า heartbeat เก่ากว่า EXPORT_JOB_STALE ถือว่า worker ตายไประหว่างทำ
+EXPORT_JOB_HEARTBEAT = 10
+EXPORT_JOB_STALE = _env_int('EXPORT_JOB_STALE', 120)
+EXPORT_JOB_ID = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+class ExportJobs:
+    def __init__(self, directory, workers, max_pending, ttl, stale):
+        self.directory = directory
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.stale = stale
+        self.executor = None
+        self.pending = 0
+        self.heartbeat_thread = None
+        self.last_cleanup = 0.0
+        self.lock = threading.Lock()
+
+    def path(self, job_id, suffix):
+        return os.path.join(self.directory, f'{job_id}.{suffix}')
+
+    def heartbeat_path(self, host, pid):
+        return os.path.join(self.directory, f'{host}-{pid}.alive')
+
+    def beat(self):
+        path = self.heartbeat_path(socket.gethostname(), os.getpid())
+        with open(path, 'a'):
+            pass
+        os.utime(path)
+
+    def heartbeat(self):
+        while True:
+            time.sleep(EXPORT_JOB_HEARTBEAT)
+            with self.lock:
+                if self.pending <= 0:
+                    self.heartbeat_thread = None
+                    return
+            try:
+                self.beat()
+            except OSError as e:
+                print(f"Export heartbeat error: {e}")
+
+    def save(self, job):
+        job['updated_at'] = time.time()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path(job['id'], 'json'))
+
+    def load(self, job_id):
+        if not EXPORT_JOB_ID.match(job_id or ''):
+            return None
+        try:
+            with open(self.path(job_id, 'json'), encoding='utf-8') as f:
+                job = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if job['state'] in ('queued', 'running'):
+            if self.alive(job):
+                return job
+            job.update(state='failed', error='งาน export หยุดกลางคัน (worker ถูกปิด) กรุณาลองใหม่')
+        # cleanup() ทำเฉพาะตอนมีงานใหม่ จึงตรวจอายุที่นี่ด้วย งานที่หมดอายุดาวน์โหลดไม่ได้และลบไฟล์ทิ้งทันที
+        if time.time() - job['updated_at'] > self.ttl:
+            self.remove(job)
+            return None
+        return job
+
+    def remove(self, job):
+        for suffix in ('json', job['format'], job['format'] + '.part'):
+            try:
+                os.unlink(self.path(job['id'], suffix))
+            except FileNotFoundError:
+                pass
+
+    def alive(self, job):
+        # ดูจาก process เจ้าของงาน: ถ้าอยู่เครื่องเดียวกันและ pid ไม่มีแล้วคือตาย ที่เหลือดู heartbeat ของ process นั้น
+        # (pid อาจถูกใช้ซ้ำหลัง restart หรือเจ้าของอยู่คนละเครื่อง)
+        if job['host'] == socket.gethostname():
+            try:
+                os.kill(job['pid'], 0)
+            except ProcessLookupError:
+                return False
+            except PermissionError:
+                pass
+        try:
+            beat = os.path.getmtime(self.heartbeat_path(job['host'], job['pid']))
+        except FileNotFoundError:
+            return False
+        return time.time() - beat <= self.stale
+
+    def submit(self, user_id, fmt, conditions, params, total):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                return None
+            self.pending += 1
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='export-job')
+        os.makedirs(self.directory, exist_ok=True)
+        # แตะ heartbeat ก่อนบันทึกงาน client ที่ poll ทันทีจึงไม่เห็นงานเป็นของ process ที่ตายแล้ว
+        self.beat()
+        with self.lock:
+            if self.heartbeat_thread is None:
+                self.heartbeat_thread = threading.Thread(target=self.heartbeat, name='export-heartbeat', daemon=True)
+                self.heartbeat_thread.start()
+        job = {'id': secrets.token_urlsafe(18), 'user_id': str(user_id), 'format': fmt, 'state': 'queued',
+               'host': socket.gethostname(), 'pid': os.getpid(), 'rows': 0, 'total': total, 'size': None, 'error': None, 'created_at': time.time(), 'finished_at': None}
+        self.save(job)
+        self.executor.submit(self.run, job, conditions, params)
+        self.cleanup()
+        return job
+
+    def run(self, job, conditions, params):
+        writer, _ = EXPORT_FORMATS[job['format']]
+        path = self.path(job['id'], job['format'])
+        tmp_path = path + '.part'
+        start = time.perf_counter()
+        last_saved = 0.0
+
+        def counted(chunks):
+            # บันทึกความคืบหน้า (จำนวนแถวที่เขียนแล้ว) อย่างมากวินาทีละครั้ง
+            nonlocal last_saved
+            for chunk in chunks:
+                yield chunk
+                job['rows'] += len(chunk)
+                if time.monotonic() - last_saved >= 1:
+                    last_saved = time.monotonic()
+                    self.save(job)
+
+        try:
+            job['state'] = 'running'
+            self.save(job)
+            with open(tmp_path, 'wb') as output:
+                chunks = counted(iter_entry_chunks(conditions, params))
+                if job['format'] == 'csv':
+                    for data in iter_csv(chunks):
+                        output.write(data)
+                else:
+                    writer(output, chunks)
+            os.replace(tmp_path, path)
+            EXPORT_SECONDS.observe(time.perf_counter() - start, job['format'])
+            job.update(state='done', size=os.path.getsize(path), finished_at=time.time())
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            job.update(state='failed', error=str(e), finished_at=time.time())
+        finally:
+            self.save(job)
+            with self.lock:
+                self.pending -= 1
+
+    def cleanup(self):
+        # ลบงาน (สถานะ + ไฟล์) ที่เก่ากว่า EXPORT_JOB_TTL ทำอย่างมากนาทีละครั้งต่อ process
+        now = time.time()
+        with self.lock:
+            if now - self.last_cleanup < 60:
+                return
+            self.last_cleanup = now
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            return {'pending': self.pending, 'workers': self.workers, 'max_pending': self.max_pending}
+
+export_jobs = ExportJobs(EXPORT_JOB_DIR, EXPORT_JOB_WORKERS, EXPORT_JOB_MAX_PENDING, EXPORT_JOB_TTL, EXPORT_JOB_STALE)
+
+def export_job_status(job):
+    return {
+        'id': job['id'],
+        'format': job['format'],
+        'state': job['state'],
+        'rows': job['rows'],
+        'total': job['total'],
+        'size': job['size'],
+        'error': job['error'],
+        'status_url': url_for('export_job_status_view', job_id=job['id']),
+        'download_url': url_for('export_job_download', job_id=job['id']) if job['state'] == 'done' else None,
+    }
+
+def load_own_export_job(job_id):
+    job = export_jobs.load(job_id)
+    if job is None or job['user_id'] != str(current_user.get_id()):
+        return None
+    return job
+
+@app.route('/export/jobs', methods=['POST'])
+@login_required
+def export_job_create():
+    fmt = request.values.get('format', 'xlsx').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'ไม่รองรับรูปแบบไฟล์ {fmt}'}), 400
+    try:
+        conditions, params = entry_filters(request.values)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    total = fetch_all(f"SELECT COUNT(*) FROM entries {where}", params)[0][0]
+    job = export_jobs.submit(current_user.get_id(), fmt, conditions, params, total)
+    if job is None:
+        return jsonify({'error': 'มีงาน export รออยู่มากเกินไป กรุณาลองใหม่ภายหลัง'}), 429
+    response = jsonify(export_job_status(job))
+    response.status_code = 202
+    response.headers['Location'] = url_for('export_job_status_view', job_id=job['id'])
+    return response
+
+@app.route('/export/jobs/<job_id>')
+@login_required
+def export_job_status_view(job_id):
+    job = load_own_export_job(job_id)
+    if job is None:
+        return jsonify({'error': 'ไม่พบงาน export หรือหมดอายุแล้ว'}), 404
+    return jsonify(export_job_status(job))
+
+@app.route('/export/jobs/<job_id>/download')
+@login_required
+def export_job_download(job_id):
+    job = load_own_export_job(job_id)
+    if job is None or job['state'] != 'done':
+        flash('ไม่พบไฟล์ export หรือหมดอายุแล้ว', 'danger')
+        return redirect(url_for('list_entries'))
+    fmt = job['format']
+    download_name = f'ข้อมูลตัวอย่าง.{fmt}'
+    try:
+        output = open(export_jobs.path(job_id, fmt), 'rb')
+    except FileNotFoundError:
+        flash('ไม่พบไฟล์ export หรือหมดอายุแล้ว', 'danger')
+        return redirect(url_for('list_entries'))
+    response = send_file(output, as_attachment=True, download_name=download_name, mimetype=EXPORT_FORMATS[fmt][1])
+    if fmt == 'csv':
+        response.headers['Content-Disposition'] = f"attachment; filename=entries.csv; filename*=UTF-8''{quote(download_name)}"
+    return response
+
+# สถิติ connection pool สำหรับผู้ดูแลระบบ (protected)
+@app.route('/pool-stats')
+@login_required
+def pool_stats():
+    return jsonify({**get_pool_stats(), 'user_cache': user_cache.stats()})
+
+# Prometheus metrics: ใช้ METRICS_TOKEN (Authorization: Bearer ...) สำหรับ scraper หรือ login ตามปกติ
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+def render_gauges(prefix, values, help_text):
+    lines = []
+    for key, value in values.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines += [f'# HELP {prefix}_{key} {help_text}', f'# TYPE {prefix}_{key} gauge', f'{prefix}_{key} {value}']
+    return lines
+
+@app.route('/metrics')
+def metrics():
+    token = request.headers.get('Authorization', '')
+    token_ok = bool(METRICS_TOKEN) and hmac.compare_digest(token.encode('utf-8'), f'Bearer {METRICS_TOKEN}'.encode('utf-8'))
+    if not token_ok and not current_user.is_authenticated:
+        if METRICS_TOKEN:
+            return Response('unauthorized\n', status=401, headers={'WWW-Authenticate': 'Bearer'})
+        return login_manager.unauthorized()
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += render_gauges('db_pool', get_pool_stats(), 'Connection pool state (see /pool-stats).')
+    lines += render_gauges('user_cache', user_cache.stats(), 'Per-process user cache.')
+    lines += render_gauges('export_cache', export_cache.stats(), 'Export file cache counters for this process.')
+    lines += render_gauges('login_hash', password_hasher.stats(), 'Password hashing pool for this process.')
+    lines += render_gauges('list_events', change_broadcaster.stats(), 'Live /list streams served by this process.')
+    lines += render_gauges('list_cache', list_cache.stats(), 'Rendered /list table cache for this process.')
+    lines += render_gauges('export_jobs', export_jobs.stats(), 'Background export jobs queued or running in this process.')
+    lines += render_gauges('read_replica', read_replica.stats(), 'Read-only routes served from the replica by this process.')
+    return Response('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
+
 with app.app_context():
     print("Starting app in app context...")
-    init_db()  # สร้างตาราง + admin
+    init_db()  # migration ของ schema + admin (รันเฉพาะขั้นที่ยังไม่ได้รัน)
     print("DB initialized!")
 
 if __name__ == '__main__':
@@ -0,0 +1,78 @@
+"""Compare /export generation time and payload size per format.
+
+Seeds a throw-away SQLite database with synthetic entries and runs each
+export writer (xlsx via openpyxl, csv, parquet) against it.
+
+    python benchmarks/bench_export.py --rows 10000 100000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(path, rows):
+    rng = random.Random(42)
+    db = sqlite3.connect(path)
+    db.execute("DELETE FROM entries")
+    db.executemany(
+        "INSERT INTO entries (code, date, weight_in, weight_out, quality) VALUES (?, ?, ?, ?, ?)",
+        (
+            (
+                f"L{rng.randint(1, 9)}R{rng.randint(1, 9)}-{i // 50:04d}-{i % 50 + 1}",
+                f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                round(rng.uniform(10, 30), 2),
+                round(rng.uniform(5, 20), 2),
+                None if rng.random() < 0.02 else round(rng.gauss(60, 7), 1),
+            )
+            for i in range(rows)
+        ),
+    )
+    db.commit()
+    db.close()
+
+
+def run(app, fmt):
+    chunks = app.iter_entry_chunks()
+    start = time.perf_counter()
+    if fmt == 'csv':
+        size = sum(len(part) for part in app.iter_csv(chunks))
+    else:
+        writer = app.EXPORT_FORMATS[fmt][0]
+        with tempfile.TemporaryFile() as output:
+            writer(output, chunks)
+            size = output.tell()
+    return time.perf_counter() - start, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--formats', nargs='+', default=['xlsx', 'csv', 'parquet'])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-export-')
+    os.environ.pop('DATABASE_URL', None)
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import app
+
+    print(f"{'rows':>9} {'format':>8} {'seconds':>9} {'rows/s':>10} {'bytes':>12} {'vs xlsx':>8}")
+    for rows in args.rows:
+        seed(os.path.join(workdir, 'database.db'), rows)
+        baseline = None
+        for fmt in args.formats:
+            seconds, size = run(app, fmt)
+            if fmt == 'xlsx':
+                baseline = seconds
+            ratio = f"{baseline / seconds:.1f}x" if baseline else '-'
+            print(f"{rows:>9} {fmt:>8} {seconds:>9.2f} {rows / seconds:>10.0f} {size:>12} {ratio:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,433 @@
+"""Load-test the main routes over synthetic entries and write the results as JSON.
+
+    python benchmarks/bench_load.py --rows 1000 100000 --requests 100
+    python benchmarks/bench_load.py --backend postgres --database-url postgresql://localhost/bench --rows 1000000
+    python benchmarks/bench_load.py --server gunicorn --workers 4 --concurrency 8
+    python benchmarks/bench_load.py --server gunicorn --threads 8 --login-storm 30 --routes form list
+    python benchmarks/bench_load.py --compare before.json after.json
+
+Every (rows, route) pair runs in a fresh process: the test-client process itself,
+or a fresh gunicorn whose largest worker is reported. So the peak RSS is per
+route. Routes that write run after the read-only ones, on the same data set. The
+export file cache is disabled unless --export-cache is given, so exports measure
+generation rather than cache hits. --login-storm keeps that many clients logging in
+(honouring Retry-After) while each route is measured, as at a shift change.
+"""
+import argparse
+import datetime
+import http.cookiejar
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (method, path, writes); read-only routes first
+ROUTES = {
+    'login_page': ('GET', '/login', False),
+    'form': ('GET', '/', False),
+    'list': ('GET', '/list', False),
+    'list_quality': ('GET', '/list?sort=quality&dir=asc', False),
+    'list_month': ('GET', '/list?from=01/03/2025&to=31/03/2025', False),
+    'export_csv': ('GET', '/export?format=csv', False),
+    'export_parquet': ('GET', '/export?format=parquet', False),
+    'export_xlsx': ('GET', '/export?format=xlsx', False),
+    'insert': ('POST', '/', True),
+    'delete': ('POST', '/delete', True),
+}
+EXPORT_ROUTES = {'export_csv', 'export_parquet', 'export_xlsx'}
+
+
+def code_for(i):
+    # BASE ของเรา: L<line>R<round>-<batch>, suffix 1..50 ต่อ BASE
+    return f"L{i % 9 + 1}R{i // 9 % 9 + 1}-{i // 50:05d}-{i % 50 + 1}"
+
+
+def synthetic_rows(rows):
+    rng = random.Random(42)
+    for i in range(rows):
+        yield (
+            code_for(i),
+            f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            round(rng.uniform(10, 30), 2),
+            round(rng.uniform(5, 20), 2),
+            None if rng.random() < 0.02 else round(rng.gauss(60, 7), 1),
+        )
+
+
+def counters_for(rows):
+    counters = {}
+    for i in range(rows):
+        base, _, suffix = code_for(i).rpartition('-')
+        counters[base] = max(counters.get(base, 0), int(suffix))
+    return counters
+
+
+def migrate(env):
+    # ให้ app สร้าง schema เอง (migration เดียวกับที่ production ใช้)
+    subprocess.run([sys.executable, '-c', 'import app'], cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def seed_sqlite(path, rows):
+    db = sqlite3.connect(path)
+    db.execute("DELETE FROM entries")
+    db.execute("DELETE FROM code_counters")
+    db.executemany("INSERT INTO entries (code, date, weight_in, weight_out, quality) VALUES (?, ?, ?, ?, ?)",
+                   synthetic_rows(rows))
+    db.executemany("INSERT INTO code_counters (base_code, last_num) VALUES (?, ?)", counters_for(rows).items())
+    db.execute("UPDATE data_version SET version = version + 1")
+    db.commit()
+    db.close()
+
+
+def seed_postgres(url, rows):
+    from sqlalchemy import create_engine
+    raw = create_engine(url).raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute("TRUNCATE entries, code_counters")
+        buffer = io.StringIO()
+        for row in synthetic_rows(rows):
+            buffer.write('\t'.join('\\N' if value is None else str(value) for value in row) + '\n')
+        buffer.seek(0)
+        cursor.copy_expert("COPY entries (code, date, weight_in, weight_out, quality) FROM STDIN", buffer)
+        cursor.executemany("INSERT INTO code_counters (base_code, last_num) VALUES (%s, %s)",
+                           list(counters_for(rows).items()))
+        cursor.execute("UPDATE data_version SET version = version + 1")
+        cursor.execute("ANALYZE entries")
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def form_data(route, index, rows):
+    if route == 'insert':
+        rng = random.Random(index)
+        return {'base_code': f"L{rng.randint(1, 9)}R{rng.randint(1, 9)}-BENCH", 'date': '15/06/2025',
+                'weight_in': '20.5', 'weight_out': '12.25', 'quality': f"{rng.gauss(60, 7):.1f}"}
+    if route == 'delete':
+        # กระจายรหัสที่ลบไปทั่วทั้งตาราง ไม่ซ้ำกัน
+        return {'code': code_for(index * 7919 % rows)}
+    return None
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def drive(make_sender, route, requests, concurrency, rows):
+    method, path, writes = ROUTES[route]
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies, errors = [], []
+
+    def worker():
+        send = make_sender()
+        if not writes:
+            send(method, path, None)  # warm-up (template / plan cache) ไม่นับ
+        while True:
+            with lock:
+                index = next(counter)
+            if index >= requests:
+                return
+            start = time.perf_counter()
+            status = send(method, path, form_data(route, index, rows))
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if status >= 400:
+                    errors.append(status)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    wall_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_start
+    return latencies, wall, errors
+
+
+def summarize(latencies, wall, errors):
+    ordered = sorted(latencies)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(ordered),
+        'errors': len(errors),
+        'p50_ms': ms(percentile(ordered, 50)),
+        'p95_ms': ms(percentile(ordered, 95)),
+        'p99_ms': ms(percentile(ordered, 99)),
+        'mean_ms': ms(sum(ordered) / len(ordered)) if ordered else None,
+        'throughput_rps': round(len(ordered) / wall, 2) if wall else None,
+    }
+
+
+def run_child(spec):
+    # โปรเซสลูกของโหมด test client: วัด RSS ของ process นี้เท่านั้น
+    sys.path.insert(0, ROOT)
+    import app
+
+    def make_sender():
+        client = app.app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'password123'})
+
+        def send(method, path, data):
+            response = client.open(path, method=method, data=data)
+            response.get_data()  # อ่าน stream ให้ครบ (CSV)
+            response.close()
+            return response.status_code
+        return send
+
+    make_sender()('GET', '/login', None)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = summarize(*drive(make_sender, spec['route'], spec['requests'], spec['concurrency'], spec['rows']))
+    result['rss_baseline_kb'] = baseline
+    result['rss_peak_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps(result))
+
+
+def run_client(route, requests, args, rows, env):
+    spec = {'route': route, 'requests': requests, 'concurrency': args.concurrency, 'rows': rows}
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', json.dumps(spec)],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def http_sender(base_url):
+    def make_sender():
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect)
+
+        def send(method, path, data):
+            body = urllib.parse.urlencode(data).encode() if data is not None else None
+            try:
+                with opener.open(urllib.request.Request(base_url + path, data=body, method=method), timeout=600) as response:
+                    response.read()
+                    return response.status
+            except urllib.error.HTTPError as e:
+                e.read()
+                return e.code
+
+        send('POST', '/login', {'username': 'admin', 'password': 'password123'})
+        return send
+    return make_sender
+
+
+def login_storm(base_url, clients, stop):
+    def client():
+        opener = urllib.request.build_opener(NoRedirect)
+        body = urllib.parse.urlencode({'username': 'admin', 'password': 'password123'}).encode()
+        while not stop.is_set():
+            retry_after = 0
+            try:
+                with opener.open(urllib.request.Request(base_url + '/login', data=body), timeout=600) as response:
+                    response.read()
+            except urllib.error.HTTPError as e:
+                e.read()
+                retry_after = float(e.headers.get('Retry-After') or 0)
+            stop.wait(retry_after)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def worker_pids(master_pid):
+    pids = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == master_pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return pids
+
+
+def peak_rss_kb(pids):
+    peak = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        peak = max(peak, int(line.split()[1]))
+        except OSError:
+            pass
+    return peak
+
+
+def run_gunicorn(route, requests, args, rows, env):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers),
+         '--threads', str(args.threads), '--timeout', '600', '--log-level', 'warning'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        base_url = f'http://127.0.0.1:{port}'
+        deadline = time.time() + 60
+        while True:
+            try:
+                urllib.request.urlopen(base_url + '/login', timeout=5).read()
+                break
+            except OSError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError('gunicorn did not start')
+                time.sleep(0.2)
+        make_sender = http_sender(base_url)
+        make_sender()('GET', '/login', None)
+        pids = worker_pids(server.pid)
+        baseline = peak_rss_kb(pids)
+        stop = threading.Event()
+        storm = login_storm(base_url, args.login_storm, stop)
+        try:
+            result = summarize(*drive(make_sender, route, requests, args.concurrency, rows))
+        finally:
+            stop.set()
+            for thread in storm:
+                thread.join()
+        result['rss_baseline_kb'] = baseline
+        result['rss_peak_kb'] = peak_rss_kb(worker_pids(server.pid))
+        return result
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return commit, bool(dirty)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"before {before['meta']['commit']}  after {after['meta']['commit']}")
+    old = {(r['rows'], r['route']): r for r in before['results']}
+    print(f"{'rows':>8} {'route':<15} {'p50 ms':>17} {'p95 ms':>17} {'req/s':>17} {'peak RSS MB':>15}")
+    for result in after['results']:
+        prev = old.get((result['rows'], result['route']))
+        if prev is None:
+            continue
+        cell = lambda key, scale=1: f"{(prev[key] or 0) / scale:8.1f} {(result[key] or 0) / scale:8.1f}"
+        print(f"{result['rows']:>8} {result['route']:<15} {cell('p50_ms')} {cell('p95_ms')} "
+              f"{cell('throughput_rps')} {cell('rss_peak_kb', 1024):>15}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--routes', nargs='+', choices=list(ROUTES), default=list(ROUTES))
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--export-requests', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--backend', choices=['sqlite', 'postgres'], default='sqlite')
+    parser.add_argument('--database-url', help='PostgreSQL database to overwrite (required with --backend postgres)')
+    parser.add_argument('--server', choices=['client', 'gunicorn'], default='client')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--export-cache', action='store_true', help='keep the export file cache on')
+    parser.add_argument('--login-storm', type=int, default=0, metavar='CLIENTS',
+                        help='clients logging in continuously while routes are measured (gunicorn only)')
+    parser.add_argument('--output', help='result file (default: bench-load-<commit>.json)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(json.loads(args.child))
+    if args.compare:
+        return compare(*args.compare)
+    if args.backend == 'postgres' and not args.database_url:
+        parser.error('--backend postgres needs --database-url')
+    if args.login_storm and args.server != 'gunicorn':
+        parser.error('--login-storm needs --server gunicorn')
+
+    workdir = tempfile.mkdtemp(prefix='bench-load-')
+    env = dict(os.environ, EXPORT_CACHE_DIR=os.path.join(workdir, 'export-cache'))
+    if not args.export_cache:
+        env['EXPORT_CACHE_MAX_MB'] = '0'
+    if args.backend == 'postgres':
+        env['DATABASE_URL'] = args.database_url
+    else:
+        env.pop('DATABASE_URL', None)
+        env['SQLITE_PATH'] = os.path.join(workdir, 'database.db')
+    commit, dirty = git_commit()
+    routes = [route for route in ROUTES if route in args.routes]
+    results = []
+    try:
+        migrate(env)
+        for rows in args.rows:
+            seed_start = time.perf_counter()
+            if args.backend == 'postgres':
+                seed_postgres(args.database_url, rows)
+            else:
+                seed_sqlite(env['SQLITE_PATH'], rows)
+            print(f"seeded {rows} rows in {time.perf_counter() - seed_start:.1f} s")
+            print(f"{'route':<15} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'peak RSS MB':>12} {'errors':>7}")
+            for route in routes:
+                requests = args.export_requests if route in EXPORT_ROUTES else args.requests
+                runner = run_gunicorn if args.server == 'gunicorn' else run_client
+                result = {'rows': rows, 'route': route, **runner(route, requests, args, rows, env)}
+                results.append(result)
+                print(f"{route:<15} {result['p50_ms']:9.2f} {result['p95_ms']:9.2f} {result['p99_ms']:9.2f} "
+                      f"{result['throughput_rps']:9.1f} {result['rss_peak_kb'] / 1024:12.1f} {result['errors']:7d}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or f"bench-load-{(commit or 'unknown')[:7]}.json"
+    meta = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'backend': args.backend,
+        'server': args.server,
+        'workers': args.workers if args.server == 'gunicorn' else None,
+        'threads': args.threads if args.server == 'gunicorn' else None,
+        'concurrency': args.concurrency,
+        'export_cache': args.export_cache,
+        'login_storm': args.login_storm,
+    }
+    with open(output, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2)
+    print(f"wrote {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Measure per-request CPU time of the HTML pages through the Flask test client.
+
+    python benchmarks/bench_pages.py --rows 5000 --requests 200
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(path, rows):
+    rng = random.Random(42)
+    db = sqlite3.connect(path)
+    db.executemany(
+        "INSERT INTO entries (code, date, weight_in, weight_out, quality) VALUES (?, ?, ?, ?, ?)",
+        (
+            (
+                f"L{rng.randint(1, 9)}R{rng.randint(1, 9)}-{i // 50:04d}-{i % 50 + 1}",
+                f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                round(rng.uniform(10, 30), 2),
+                round(rng.uniform(5, 20), 2),
+                round(rng.gauss(60, 7), 1),
+            )
+            for i in range(rows)
+        ),
+    )
+    db.commit()
+    db.close()
+
+
+def measure(client, path, requests):
+    client.get(path)  # warm-up
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for _ in range(requests):
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.status_code)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    return cpu / requests * 1000, wall / requests * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--paths', nargs='+', default=['/login', '/', '/list'])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-pages-')
+    os.environ.pop('DATABASE_URL', None)
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import app
+
+    seed(os.path.join(workdir, 'database.db'), args.rows)
+    anonymous = app.app.test_client()
+    client = app.app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'password123'})
+
+    print(f"{'path':>8} {'cpu ms/req':>11} {'wall ms/req':>12}")
+    for path in args.paths:
+        cpu_ms, wall_ms = measure(anonymous if path == '/login' else client, path, args.requests)
+        print(f"{path:>8} {cpu_ms:>11.3f} {wall_ms:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
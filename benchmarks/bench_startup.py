@@ -0,0 +1,71 @@
+"""Measure worker cold start: a fresh interpreter importing app and serving its first /login.
+
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --repo /path/to/older/checkout
+
+Each run is a new process against an already-initialised SQLite database, which is
+what a gunicorn worker (re)start sees. The first boot on an empty database is
+reported separately.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import sys, time
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/login')
+assert response.status_code == 200, response.status_code
+served = time.perf_counter()
+heavy = ','.join(name for name in ('numpy', 'openpyxl', 'pandas', 'pyarrow') if name in sys.modules) or '-'
+print((imported - start) * 1000, (served - start) * 1000, heavy)
+"""
+
+
+def run_once(repo, workdir):
+    env = dict(os.environ)
+    env.pop('DATABASE_URL', None)
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, repo],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True,
+    ).stdout.strip().splitlines()[-1]
+    import_ms, first_ms, heavy = output.split()
+    return float(import_ms), float(first_ms), heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--repo', default=ROOT, help='checkout to measure (default: this one)')
+    args = parser.parse_args()
+
+    repo = os.path.abspath(args.repo)
+    workdir = tempfile.mkdtemp(prefix='bench-startup-')
+    try:
+        boot_import, boot_first, _ = run_once(repo, workdir)
+        print(f'first boot (empty db): import {boot_import:.0f} ms, first /login {boot_first:.0f} ms')
+
+        imports, firsts = [], []
+        for _ in range(args.runs):
+            import_ms, first_ms, heavy = run_once(repo, workdir)
+            imports.append(import_ms)
+            firsts.append(first_ms)
+        print(f'restart x{args.runs}: import median {statistics.median(imports):.0f} ms '
+              f'(min {min(imports):.0f}), first /login median {statistics.median(firsts):.0f} ms '
+              f'(min {min(firsts):.0f})')
+        print(f'heavy modules loaded after first /login: {heavy}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
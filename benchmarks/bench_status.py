@@ -0,0 +1,69 @@
+"""Time quality-group classification: per-row Series.apply vs vectorized lookup.
+
+    python benchmarks/bench_status.py --rows 10000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# if/elif chain as it was written in get_status before the bucket table
+def legacy_get_status(quality):
+    if quality is None:
+        return '<span class="badge bg-secondary">ไม่ระบุ</span>'
+    elif quality < 50:
+        return '<span class="badge bg-danger">ส่งไปกลุ่ม < 50%</span>'
+    elif 50 <= quality < 55:
+        return '<span class="badge bg-warning">ส่งไปกลุ่ม 50 - 54.9%</span>'
+    elif 55 <= quality < 60:
+        return '<span class="badge bg-info">ส่งไปกลุ่ม 55 - 59.9%</span>'
+    elif 60 <= quality < 65:
+        return '<span class="badge bg-primary">ส่งไปกลุ่ม 60 - 64.9%</span>'
+    elif 65 <= quality < 68:
+        return '<span class="badge bg-success">ส่งไปกลุ่ม 65 - 67.9%</span>'
+    elif 68 <= quality < 70:
+        return '<span class="badge bg-dark">ส่งไปกลุ่ม 68 - 69.9%</span>'
+    else:
+        return '<span class="badge bg-success">ส่งไปกลุ่ม > 70%</span>'
+
+
+def best_of(repeat, func):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ.pop('DATABASE_URL', None)
+    os.chdir(tempfile.mkdtemp(prefix='bench-status-'))
+    sys.path.insert(0, ROOT)
+    import app
+
+    rng = np.random.default_rng(42)
+    print(f"{'rows':>9} {'apply (s)':>10} {'vector (s)':>11} {'speedup':>8}")
+    for rows in args.rows:
+        values = rng.normal(60, 7, rows).round(1)
+        values[rng.random(rows) < 0.02] = np.nan
+        series = pd.Series(values)
+        apply_s = best_of(args.repeat, lambda: series.apply(legacy_get_status))
+        vector_s = best_of(args.repeat, lambda: app.status_badges(series))
+        print(f"{rows:>9} {apply_s:>10.4f} {vector_s:>11.4f} {apply_s / vector_s:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()